@@ -1,14 +1,41 @@
-from flask import Flask
+from flask import Flask, g, request
 from flask_cors import CORS
 from flask_session import Session
 from app.config import config
 from app.routes.oauth import oauth_bp
 from app.routes.playlists import playlists_bp
+from app.routes.metrics import metrics_bp
+from app.utils import close_session, close_redis
+from app.utils import event_loop, metrics
+import functools
 import os
 import logging
 import sys
+import time
 
-app = Flask(__name__)
+class YouTifyFlask(Flask):
+    # Served over ASGI, async views run on the worker's long-lived loop and share its pools.
+    # Otherwise Flask runs every async view in its own event loop, so release the loop's pooled
+    # upstream and Redis connections before that loop is torn down so none of them leak
+    def async_to_sync(self, func):
+        if event_loop.get_loop() is not None:
+            @functools.wraps(func)
+            def run_on_app_loop(*args, **kwargs):
+                return event_loop.run(func(*args, **kwargs))
+
+            return run_on_app_loop
+
+        @functools.wraps(func)
+        async def run_with_pooled_resources(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                await close_session()
+                await close_redis()
+
+        return super().async_to_sync(run_with_pooled_resources)
+
+app = YouTifyFlask(__name__)
 app.config.from_object(config["default"])
 
 # CORS config
@@ -24,6 +51,29 @@ Session(app)
 # Routes and blueprints config
 app.register_blueprint(oauth_bp, url_prefix="/oauth")
 app.register_blueprint(playlists_bp, url_prefix="/playlists")
+app.register_blueprint(metrics_bp, url_prefix="/metrics")
+
+# Request metrics (see app/utils/metrics.py)
+# Timed until the view returns, so streamed responses are counted once streaming starts
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    metrics.HTTP_REQUESTS_IN_FLIGHT.inc()
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exception):
+    if "request_start" not in g:
+        return
+
+    metrics.HTTP_REQUESTS_IN_FLIGHT.dec()
+    # Unhandled exceptions skip after_request and are answered with a 500
+    status = g.get("response_status", 500)
+    metrics.HTTP_REQUEST_SECONDS.labels(request.endpoint or "unknown", request.method, status).observe(time.perf_counter() - g.request_start)
 
 # Logging config
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
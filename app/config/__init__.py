@@ -1 +1,2 @@
 from .config import config
+from .config import redis_pool
@@ -1,22 +1,107 @@
 from dotenv import load_dotenv
-from redis import Redis
+from redis import Redis, BlockingConnectionPool
 import os
 import datetime
 
 load_dotenv(".env")
 
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_POOL_LIMIT = int(os.getenv("REDIS_POOL_LIMIT", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 10)) # seconds
+
+# Requests each ASGI worker handles at the same time, each in its own thread (see asgi.py)
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", 200))
+
+# Process-wide pool for synchronous Redis clients (Flask-Session and any sync helpers)
+# Blocking, so commands past the limit wait up to REDIS_POOL_TIMEOUT for a free
+# connection instead of failing with "Too many connections". Every ASGI thread loads and
+# saves its request's session through it, so it has at least one connection per thread
+redis_pool = BlockingConnectionPool.from_url(REDIS_URL, max_connections=max(REDIS_POOL_LIMIT, ASGI_THREADS),
+                                             timeout=REDIS_POOL_TIMEOUT)
+
 class Config(object):
     # Flask base config
     SECRET_KEY = os.getenv("APP_SECRET_KEY")
 
     # Flask-Session config
     SESSION_TYPE = "redis"
-    SESSION_REDIS = Redis.from_url(os.getenv("REDIS_URL"))
+    SESSION_REDIS = Redis(connection_pool=redis_pool)
     PERMANENT_SESSION_LIFETIME = datetime.timedelta(days=1)
     SESSION_COOKIE_DOMAIN = os.getenv("APP_DOMAIN")
     SESSION_COOKIE_SAMESITE = "None"
     SESSION_COOKIE_SECURE = True
 
+    # Upstream HTTP connection pool config (shared by SpotifyService and YouTubeService)
+    HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+    HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 50))
+    HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300)) # seconds
+    HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30)) # seconds
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)) # seconds
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30)) # seconds
+    HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", 60)) # seconds
+
+    # Adaptive upstream concurrency (in-flight requests per provider, see app/utils/concurrency.py)
+    SPOTIFY_CONCURRENCY_INITIAL = int(os.getenv("SPOTIFY_CONCURRENCY_INITIAL", 10))
+    SPOTIFY_CONCURRENCY_MIN = int(os.getenv("SPOTIFY_CONCURRENCY_MIN", 1))
+    SPOTIFY_CONCURRENCY_MAX = int(os.getenv("SPOTIFY_CONCURRENCY_MAX", 50))
+    YOUTUBE_CONCURRENCY_INITIAL = int(os.getenv("YOUTUBE_CONCURRENCY_INITIAL", 10))
+    YOUTUBE_CONCURRENCY_MIN = int(os.getenv("YOUTUBE_CONCURRENCY_MIN", 1))
+    YOUTUBE_CONCURRENCY_MAX = int(os.getenv("YOUTUBE_CONCURRENCY_MAX", 50))
+
+    # Cross-worker upstream rate limits (requests/s and burst size, see app/utils/rate_limiter.py)
+    SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", 20))
+    SPOTIFY_RATE_BURST = float(os.getenv("SPOTIFY_RATE_BURST", 40))
+    YOUTUBE_RATE_LIMIT = float(os.getenv("YOUTUBE_RATE_LIMIT", 20))
+    YOUTUBE_RATE_BURST = float(os.getenv("YOUTUBE_RATE_BURST", 40))
+    RATE_LIMIT_ACTIVE_WINDOW = int(os.getenv("RATE_LIMIT_ACTIVE_WINDOW", 10)) # seconds
+
+    # Upstream retry policy (see app/utils/retry.py)
+    RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 5))
+    RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5)) # seconds
+    RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 16)) # seconds
+    RETRY_MAX_ELAPSED = float(os.getenv("RETRY_MAX_ELAPSED", 60)) # seconds
+
+    # YouTube Data API daily quota in units (see app/utils/quota.py)
+    YOUTUBE_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", 10000))
+
+    # Track search cache ttls (see app/utils/search_cache.py)
+    SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 60 * 60 * 24)) # seconds
+    SEARCH_CACHE_NEGATIVE_TTL = int(os.getenv("SEARCH_CACHE_NEGATIVE_TTL", 60 * 60)) # seconds
+
+    # YouTube video metadata cache ttls (see app/utils/video_cache.py)
+    VIDEO_CACHE_TTL = int(os.getenv("VIDEO_CACHE_TTL", 60 * 60 * 24 * 7)) # seconds
+    VIDEO_CACHE_NEGATIVE_TTL = int(os.getenv("VIDEO_CACHE_NEGATIVE_TTL", 60 * 60)) # seconds
+
+    # How long a cross-provider track mapping is kept (see app/utils/track_map.py)
+    TRACK_MAP_TTL = int(os.getenv("TRACK_MAP_TTL", 60 * 60 * 24 * 30)) # seconds
+
+    # How long an unused library listing is kept (see app/utils/library_cache.py)
+    LIBRARY_CACHE_TTL = int(os.getenv("LIBRARY_CACHE_TTL", 60 * 60 * 24 * 30)) # seconds
+
+    # How long an unfinished conversion can be resumed (see app/utils/checkpoints.py)
+    CHECKPOINT_TTL = int(os.getenv("CHECKPOINT_TTL", 60 * 60 * 24)) # seconds
+
+    # In-process cache tier in front of Redis (see app/utils/redis_utils.py)
+    # Namespaces are key prefixes before the first ":"; caps apply per namespace
+    LOCAL_CACHE_NAMESPACES = os.getenv("LOCAL_CACHE_NAMESPACES", "spotify_search,youtube_search,track_map,youtube_video").split(",")
+    LOCAL_CACHE_MAX_ITEMS = int(os.getenv("LOCAL_CACHE_MAX_ITEMS", 10000))
+    LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+    LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", 300)) # seconds
+
+    # Tokens expiring within this many seconds are refreshed before calling upstream
+    TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", 300)) # seconds
+
+    # Bearer token required by /metrics (open if unset, e.g. when only reachable internally)
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+    # Redis connection pool config (sync pool above, async pools in app/utils/redis_utils.py)
+    REDIS_URL = REDIS_URL
+    REDIS_POOL_LIMIT = REDIS_POOL_LIMIT
+    REDIS_POOL_TIMEOUT = REDIS_POOL_TIMEOUT
+
+    # ASGI serving mode (see asgi.py)
+    ASGI_THREADS = ASGI_THREADS
+
 config = {
     "default": Config
 }
@@ -0,0 +1,19 @@
+from flask import Blueprint, request
+from app.config import config
+from app.utils import metrics
+import hmac
+
+# Create /metrics blueprint
+metrics_bp = Blueprint("metrics", __name__)
+
+settings = config["default"]
+
+# Prometheus metrics of this process (or of every worker process in multiprocess mode)
+@metrics_bp.route("")
+def get_metrics():
+    if settings.METRICS_TOKEN:
+        authorization = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization, f"Bearer {settings.METRICS_TOKEN}"):
+            return { "error": "Not authorized" }, 401
+
+    return metrics.generate(), 200, { "Content-Type": metrics.CONTENT_TYPE }
@@ -1,8 +1,7 @@
-from flask import Blueprint, redirect, request, session, jsonify, url_for
+from flask import Blueprint, redirect, request, session, jsonify
 from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
 from app.services import YouTubeService
+from app.services import CredentialService, RefreshFailed
 import os
 import requests
 import urllib.parse
@@ -75,8 +74,9 @@ def youtube_callback():
     return { "success": True }
 
 # YouTube refresh token endpoint
+# Other endpoints refresh expiring tokens in-band, this is kept for clients that still redirect here
 @oauth_bp.route("/youtube/refresh-token")
-def youtube_refresh_token():
+async def youtube_refresh_token():
     redirect_origin_url = session.pop("redirect_origin_url", None)
     if redirect_origin_url is None:
         # This endpoint should only be reached via a redirect from another endpoint
@@ -85,23 +85,23 @@ def youtube_refresh_token():
     if "youtube_credentials" not in session:
         return jsonify({ "error": "Not authorized"}), 401
     
-    credentials = Credentials.from_authorized_user_info(session["youtube_credentials"])
-    if credentials.expired:
-        credentials.refresh(Request())
-        session["youtube_credentials"] = YouTubeService.format_credentials(credentials)
+    try:
+        await CredentialService.ensure_youtube()
+    except RefreshFailed:
+        return jsonify({ "error": "Not authorized"}), 401
 
     return redirect(redirect_origin_url), 308
 
 # YouTube check login status
 @oauth_bp.route("/youtube/status")
-def youtube_status():
+async def youtube_status():
     if "youtube_credentials" not in session:
         return jsonify({ "is_logged_in": False })
     
-    credentials = Credentials.from_authorized_user_info(session["youtube_credentials"])
-    if credentials.expired:
-        session["redirect_origin_url"] = url_for("oauth.youtube_status")
-        return redirect(url_for("oauth.youtube_refresh_token")), 307
+    try:
+        await CredentialService.ensure_youtube()
+    except RefreshFailed:
+        return jsonify({ "is_logged_in": False })
     
     return jsonify({ "is_logged_in": True })
 
@@ -154,8 +154,9 @@ def spotify_callback():
     return jsonify({ "error": "Bad request to callback" }), 400
 
 # Spotify refresh token endpoint
+# Other endpoints refresh expiring tokens in-band, this is kept for clients that still redirect here
 @oauth_bp.route("/spotify/refresh-token")
-def spotify_refresh_token():
+async def spotify_refresh_token():
     redirect_origin_url = session.pop("redirect_origin_url", None)
     if redirect_origin_url is None:
         # This endpoint should only be reached via a redirect from another endpoint
@@ -164,30 +165,22 @@ def spotify_refresh_token():
     if "spotify_credentials" not in session:
         return jsonify({ "error": "Not authorized"}), 401
     
-    if datetime.datetime.now().timestamp() > session["spotify_credentials"]["expires_at"]:
-        req_body = {
-            "grant_type": "refresh_token",
-            "refresh_token": session["spotify_credentials"]["refresh_token"],
-            "client_id": SPOTIFY_CLIENT_ID,
-            "client_secret": SPOTIFY_CLIENT_SECRET
-        }
-    
-        response = requests.post(SPOTIFY_TOKEN_URL, data=req_body)
-        new_token_info = response.json()
-
-        session["spotify_credentials"]["access_token"] = new_token_info["access_token"]
-        session["spotify_credentials"]["expires_at"] = datetime.datetime.now().timestamp() + new_token_info["expires_in"]
+    try:
+        await CredentialService.ensure_spotify()
+    except RefreshFailed:
+        return jsonify({ "error": "Not authorized"}), 401
 
     return redirect(redirect_origin_url), 308
 
 # Spotify check login status
 @oauth_bp.route("/spotify/status")
-def spotify_status():
+async def spotify_status():
     if "spotify_credentials" not in session:
         return jsonify({ "is_logged_in": False })
 
-    if datetime.datetime.now().timestamp() > session["spotify_credentials"]["expires_at"]:
-        session["redirect_origin_url"] = url_for("oauth.spotify_status")
-        return redirect(url_for("oauth.spotify_refresh_token")), 307
+    try:
+        await CredentialService.ensure_spotify()
+    except RefreshFailed:
+        return jsonify({ "is_logged_in": False })
     
-    return jsonify({ "is_logged_in": True })
\ No newline at end of file
+    return jsonify({ "is_logged_in": True })
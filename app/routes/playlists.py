@@ -1,34 +1,145 @@
-from flask import Blueprint, jsonify, redirect, session, url_for, request
-from google.oauth2.credentials import Credentials
+from flask import Blueprint, jsonify, session, url_for, request
 from googleapiclient.errors import HttpError
 from app.services import SpotifyService
 from app.services import YouTubeService
-import datetime
+from app.services import ConversionService
+from app.services import CredentialService, RefreshFailed
+from app.services.spotify_service import TRACKS_PAGE_SIZE as SPOTIFY_TRACKS_PAGE_SIZE
+from app.services.youtube_service import PAGE_SIZE as YOUTUBE_TRACKS_PAGE_SIZE
+from app.utils import checkpoints, jobs, quota, rate_limiter
+from app.utils import streaming
+from app.utils.pagination import encode_cursor, decode_cursor
+import dataclasses
+import functools
 import asyncio
 import aiohttp
 
 # Create /playlists blueprint
 playlists_bp = Blueprint("playlists", __name__)
 
+# Create endpoints queue a job instead of converting inline when called with ?async=true
+def is_async_mode():
+    return request.args.get("async", "false").lower() == "true"
+
+# Create endpoints sync playlists converted before (instead of creating them again) with ?sync=true
+# Playlists need the "id" they have in the source service to be synced
+def is_sync_mode():
+    return request.args.get("sync", "false").lower() == "true"
+
+# Key a create request is checkpointed under, from its Idempotency-Key header
+# Sending the same key again resumes the request where it stopped (or returns its result).
+# None without the header, so a repeated request without one is converted again
+def request_key(kind):
+    key = request.headers.get("Idempotency-Key")
+    if key is None:
+        return None
+    return f"{kind}:{rate_limiter.user_key()}:{key}"
+
+# Refuse a request whose Idempotency-Key is used by a running conversion or was used with another body
+# Raises checkpoints.RequestInProgress or checkpoints.RequestMismatch
+async def check_request_key(key, playlists):
+    await checkpoints.check_body(key, playlists)
+    if await checkpoints.in_progress(key):
+        raise checkpoints.RequestInProgress()
+
+def request_key_error(e):
+    status = 422 if isinstance(e, checkpoints.RequestMismatch) else 409
+    return jsonify({ "error": str(e) }), status
+
+def job_accepted(job_id):
+    status_url = url_for("playlists.get_job_status", job_id=job_id)
+    return jsonify({ "job_id": job_id, "status_url": status_url }), 202, { "Location": status_url }
+
+# Listings include every playlist's tracks unless called with ?tracks=false
+def include_tracks():
+    return request.args.get("tracks", "true").lower() != "false"
+
+# Position and size of a track page from ?cursor= and ?limit= (at most max_limit)
+# Raises ValueError for invalid values
+def track_page_args(cursor_field, default_position, max_limit):
+    position = default_position
+    if "cursor" in request.args:
+        position = decode_cursor(request.args["cursor"]).get(cursor_field)
+        # Cursors come from the client, so check the position is one we could have encoded
+        if cursor_field == "offset":
+            valid = isinstance(position, int) and not isinstance(position, bool) and position >= 0
+        else:
+            valid = isinstance(position, str)
+        if not valid:
+            raise ValueError("Invalid cursor")
+
+    limit = int(request.args.get("limit", max_limit))
+    if not 1 <= limit <= max_limit:
+        raise ValueError(f"limit must be between 1 and {max_limit}")
+    return position, limit
+
+def tracks_page(tracks, cursor_field, next_position):
+    next_cursor = encode_cursor({ cursor_field: next_position }) if next_position is not None else None
+    return jsonify({ "tracks": tracks, "next_cursor": next_cursor })
+
+# Yield ("playlist", playlist) as soon as each playlist's tracks resolve, in completion order
+# Streamed playlists are copies, so the listing itself never holds on to their tracks
+# get_tracks(playlist) returns the playlist's tracks
+async def iter_playlists_with_tracks(get_tracks, playlists, skip_empty=False):
+    async def _with_tracks(playlist):
+        return dataclasses.replace(playlist, tracks=await get_tracks(playlist))
+
+    tasks = [asyncio.create_task(_with_tracks(playlist)) for playlist in playlists]
+    try:
+        for next_playlist in asyncio.as_completed(tasks):
+            playlist = await next_playlist
+            if playlist.tracks or not skip_empty:
+                yield "playlist", playlist
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# Error event for a failure after a streamed response has started
+def stream_error(provider):
+    def _on_error(e):
+        if isinstance(e, aiohttp.ClientResponseError):
+            if e.status == 401:
+                return { "error": "Not authorized", "status": e.status }
+            elif e.status == 429:
+                return { "error": f"{provider} rate limit exceeded. Please try again later", "status": e.status }
+        return { "error": "Internal server error. Please contact the developer", "status": 500 }
+
+    return _on_error
+
 
 # ==================== SPOTIFY ENDPOINTS ====================
 
 
+# The listing's snapshot_id lets unchanged playlists be served from the library cache
+def get_spotify_tracks(spotify, playlist):
+    return spotify.get_playlist_tracks(playlist.id, playlist.snapshot_id)
+
 # Get all Spotify playlists + tracks
 @playlists_bp.route("/spotify")
 async def get_spotify_playlists():
     if "spotify_credentials" not in session:
         return { "error": "Not authorized" }, 401
 
-    if datetime.datetime.now().timestamp() > session["spotify_credentials"]["expires_at"]:
-        session["redirect_origin_url"] = url_for("playlists.get_spotify_playlists")
-        return redirect(url_for("oauth.spotify_refresh_token"))
-    
     try:
-        playlists = await SpotifyService.get_playlists()
+        spotify = SpotifyService(await CredentialService.ensure_spotify())
+    except RefreshFailed:
+        return { "error": "Not authorized" }, 401
     
+    try:
+        playlists = await spotify.get_playlists()
+
+        # Playlists-only mode: tracks are loaded per playlist from /spotify/<playlist_id>/tracks
+        if not include_tracks():
+            return jsonify(playlists)
+
+        # Streaming mode: send each playlist as soon as its tracks are in
+        stream_format = streaming.stream_format()
+        if stream_format:
+            events = iter_playlists_with_tracks(functools.partial(get_spotify_tracks, spotify), playlists["playlists"])
+            return streaming.stream_response(stream_format, events, stream_error("Spotify"))
+
         # Asynchronous calls to Spotify API
-        tasks = [SpotifyService.get_playlist_tracks(playlist.id) for playlist in playlists["playlists"]]
+        tasks = [get_spotify_tracks(spotify, playlist) for playlist in playlists["playlists"]]
         results = await asyncio.gather(*tasks)
     except aiohttp.ClientResponseError as e:
         if e.status == 401:
@@ -46,15 +157,49 @@ async def get_spotify_playlists():
 
     return jsonify(playlists)
 
+# Get a page of a Spotify playlist's tracks
+# Pass next_cursor from the previous page as ?cursor= for the next one (null on the last page)
+@playlists_bp.route("/spotify/<playlist_id>/tracks")
+async def get_spotify_playlist_tracks(playlist_id):
+    if "spotify_credentials" not in session:
+        return { "error": "Not authorized" }, 401
+
+    try:
+        spotify = SpotifyService(await CredentialService.ensure_spotify())
+    except RefreshFailed:
+        return { "error": "Not authorized" }, 401
+
+    try:
+        offset, limit = track_page_args("offset", 0, SPOTIFY_TRACKS_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({ "error": str(e) }), 400
+
+    try:
+        tracks, next_offset = await spotify.get_playlist_tracks_page(playlist_id, offset, limit)
+    except aiohttp.ClientResponseError as e:
+        if e.status == 401:
+            return { "error": "Not authorized"}, 401
+        elif e.status == 404:
+            return { "error": "Not found" }, 404
+        elif e.status == 429:
+            return { "error": "Spotify rate limit exceeded. Please try again later" }, 429
+        else:
+            return { "error": "Internal server error. Please contact the developer" }, 500
+    except Exception as e:
+            return { "error": "Internal server error. Please contact the developer" }, 500
+
+    return tracks_page(tracks, "offset", next_offset)
+
 # Create Spotify playlists
 @playlists_bp.route("/spotify/create", methods=["POST"])
 async def create_youtube_playlists():
     if "spotify_credentials" not in session:
         return { "error": "Not authorized" }, 401
 
-    if datetime.datetime.now().timestamp() > session["spotify_credentials"]["expires_at"]:
-        session["redirect_origin_url"] = url_for("playlists.create_youtube_playlists")
-        return redirect(url_for("oauth.spotify_refresh_token"))
+    try:
+        spotify = SpotifyService(await CredentialService.ensure_spotify())
+    except RefreshFailed:
+        return { "error": "Not authorized" }, 401
     
     if "playlists" not in request.json:
         return jsonify({ "error": "Request body must contain playlists" }), 400
@@ -62,18 +207,24 @@ async def create_youtube_playlists():
     playlists = request.json["playlists"]
 
     try:
-        # Create playlists
-        create_playlist_tasks = [SpotifyService.create_playlist(playlist["name"], playlist["description"]) for playlist in playlists]
-        new_playlist_ids = await asyncio.gather(*create_playlist_tasks)
+        await check_request_key(request_key("spotify"), playlists)
+    except (checkpoints.RequestInProgress, checkpoints.RequestMismatch) as e:
+        return request_key_error(e)
 
-        # Search tracks
-        search_track_tasks = [SpotifyService.search_tracks([track["name"] for track in playlist["tracks"]]) for playlist in playlists]
-        track_uris_list = await asyncio.gather(*search_track_tasks)
+    # Async mode: queue the conversion for worker.py and return its job id
+    if is_async_mode():
+        job_id = await jobs.enqueue_job("spotify", rate_limiter.user_key(), playlists,
+                                        { "spotify_credentials": session["spotify_credentials"] },
+                                        sync=is_sync_mode(), request_key=request_key("spotify"))
+        return job_accepted(job_id)
 
-        # # Add tracks to playlist
-        fill_playlist_tasks = [SpotifyService.fill_playlist(playlist_id, track_uris) for playlist_id, track_uris in zip(new_playlist_ids, track_uris_list)]
-        fill_playlist_results = await asyncio.gather(*fill_playlist_tasks)
-        
+    try:
+        if is_sync_mode():
+            fill_playlist_results = await ConversionService.sync_spotify_playlists(spotify, playlists, request_key=request_key("spotify"))
+        else:
+            fill_playlist_results = await ConversionService.create_spotify_playlists(spotify, playlists, request_key=request_key("spotify"))
+    except (checkpoints.RequestInProgress, checkpoints.RequestMismatch) as e:
+        return request_key_error(e)
     except aiohttp.ClientResponseError as e:
         if e.status == 401:
             return { "error": "Not authorized"}, 401
@@ -90,21 +241,35 @@ async def create_youtube_playlists():
 # ==================== YOUTUBE ENDPOINTS ====================
 
 
+def get_youtube_tracks(youtube, playlist):
+    return youtube.get_playlist_tracks(playlist.id)
+
 # Get all YouTube playlists + tracks
 @playlists_bp.route("/youtube")
 async def get_youtube_playlists():
     if "youtube_credentials" not in session:
         return jsonify({ "error": "Not authorized"}), 401
     
-    credentials = Credentials.from_authorized_user_info(session["youtube_credentials"])
-    if credentials.expired:
-        session["redirect_origin_url"] = url_for("playlists.get_youtube_playlists")
-        return redirect(url_for("oauth.youtube_refresh_token"))
+    try:
+        youtube = YouTubeService(await CredentialService.ensure_youtube())
+    except RefreshFailed:
+        return jsonify({ "error": "Not authorized"}), 401
     
     try:
-        playlists = await YouTubeService.get_playlists()
+        playlists = await youtube.get_playlists()
+
+        # Playlists-only mode: tracks are loaded per playlist from /youtube/<playlist_id>/tracks
+        # (playlists without music are only known once their tracks are, so none are filtered out)
+        if not include_tracks():
+            return jsonify(playlists)
+
+        # Streaming mode: send each playlist (that contains music) as soon as its tracks are in
+        stream_format = streaming.stream_format()
+        if stream_format:
+            events = iter_playlists_with_tracks(functools.partial(get_youtube_tracks, youtube), playlists["playlists"], skip_empty=True)
+            return streaming.stream_response(stream_format, events, stream_error("YouTube"))
 
-        tasks = [YouTubeService.get_playlist_tracks(playlist.id) for playlist in playlists["playlists"]]
+        tasks = [get_youtube_tracks(youtube, playlist) for playlist in playlists["playlists"]]
         results = await asyncio.gather(*tasks)
     except aiohttp.ClientResponseError as e:
         if e.status == 403:
@@ -134,16 +299,56 @@ async def get_youtube_playlists():
 
     return jsonify(playlists)
 
+# Get a page of a YouTube playlist's music tracks
+# Pass next_cursor from the previous page as ?cursor= for the next one (null on the last page).
+# Non-music videos are left out, so a page may hold fewer than limit tracks (even none)
+@playlists_bp.route("/youtube/<playlist_id>/tracks")
+async def get_youtube_playlist_tracks(playlist_id):
+    if "youtube_credentials" not in session:
+        return jsonify({ "error": "Not authorized"}), 401
+
+    try:
+        youtube = YouTubeService(await CredentialService.ensure_youtube())
+    except RefreshFailed:
+        return jsonify({ "error": "Not authorized"}), 401
+
+    try:
+        page_token, limit = track_page_args("page_token", None, YOUTUBE_TRACKS_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({ "error": str(e) }), 400
+
+    try:
+        tracks, next_page_token = await youtube.get_playlist_tracks_page(playlist_id, page_token, limit)
+    except aiohttp.ClientResponseError as e:
+        if e.status == 403:
+            # Possible reasons for playlistItems.list:
+            # playlistItemsNotAccessible
+            # watchHistoryNotAccessible
+            # watchLaterNotAccessible
+            return { "error": "Forbidden"}, e.status
+        elif e.status == 404:
+            # Possible reasons for playlistItems.list:
+            # playlistNotFound
+            return { "error": "Not found" }, e.status
+        elif e.status == 429:
+            return { "error": "YouTube rate limit exceeded. Please try again later" }, e.status
+        else:
+            return { "error": "Internal server error. Please contact the developer" }, 500
+    except Exception as e:
+            return { "error": "Internal server error. Please contact the developer" }, 500
+
+    return tracks_page(tracks, "page_token", next_page_token)
+
 # Create a YouTube playlist
 @playlists_bp.route("/youtube/create", methods=["POST"])
 async def create_youtube_playlist():
     if "youtube_credentials" not in session:
         return jsonify({ "error": "Not authorized"}), 401
     
-    credentials = Credentials.from_authorized_user_info(session["youtube_credentials"])
-    if credentials.expired:
-        session["redirect_origin_url"] = url_for("playlists.create_youtube_playlist")
-        return redirect(url_for("oauth.youtube_refresh_token"))
+    try:
+        youtube = YouTubeService(await CredentialService.ensure_youtube())
+    except RefreshFailed:
+        return jsonify({ "error": "Not authorized"}), 401
     
     if "playlists" not in request.json:
         return jsonify({ "error": "Request body must contain playlists" }), 400
@@ -151,18 +356,42 @@ async def create_youtube_playlist():
     playlists = request.json["playlists"]
 
     try:
-        # Create playlists
-        create_playlist_tasks = [YouTubeService.create_playlist(playlist["name"], playlist["description"]) for playlist in playlists]
-        new_playlist_ids = await asyncio.gather(*create_playlist_tasks)
+        await check_request_key(request_key("youtube"), playlists)
+    except (checkpoints.RequestInProgress, checkpoints.RequestMismatch) as e:
+        return request_key_error(e)
+
+    try:
+        # Fail up front instead of running out of quota halfway through
+        if is_sync_mode():
+            estimated_cost = await youtube.estimate_sync_cost(playlists, "spotify")
+        else:
+            estimated_cost = await YouTubeService.estimate_create_cost(playlists, "spotify", request_key("youtube"))
+
+        # Async mode: queue the conversion for worker.py (which reserves the quota) and return its job id
+        if is_async_mode():
+            remaining_quota = await quota.remaining()
+            if estimated_cost > remaining_quota:
+                raise quota.QuotaExceeded(estimated_cost, remaining_quota)
 
-        # Search tracks
-        search_track_tasks = [YouTubeService.search_tracks([track["name"] for track in playlist["tracks"]]) for playlist in playlists]
-        video_ids_list = await asyncio.gather(*search_track_tasks)
+            job_id = await jobs.enqueue_job("youtube", rate_limiter.user_key(), playlists,
+                                            { "youtube_credentials": session["youtube_credentials"] },
+                                            sync=is_sync_mode(), request_key=request_key("youtube"))
+            return job_accepted(job_id)
 
-        # Add tracks to playlist
-        fill_playlist_tasks = [YouTubeService.fill_playlist(playlist_id, video_ids) for playlist_id, video_ids in zip(new_playlist_ids, video_ids_list)]
-        fill_playlist_results = await asyncio.gather(*fill_playlist_tasks)
+        async with quota.reservation(estimated_cost):
+            if is_sync_mode():
+                fill_playlist_results = await ConversionService.sync_youtube_playlists(youtube, playlists, request_key=request_key("youtube"))
+            else:
+                fill_playlist_results = await ConversionService.create_youtube_playlists(youtube, playlists, request_key=request_key("youtube"))
 
+    except quota.QuotaExceeded as e:
+        return jsonify({
+            "error": "Not enough YouTube quota left today to complete this request. Please try again later",
+            "estimated_cost": e.estimate,
+            "remaining_quota": e.remaining
+        }), 429, { "Retry-After": str(e.retry_after) }
+    except (checkpoints.RequestInProgress, checkpoints.RequestMismatch) as e:
+        return request_key_error(e)
     except aiohttp.ClientResponseError as e:
         if e.status == 403:
             # Possible reasons for playlists.list:
@@ -185,3 +414,17 @@ async def create_youtube_playlist():
             return { "error": "Internal server error. Please contact the developer" }, 500
 
     return jsonify(fill_playlist_results)
+
+
+# ==================== JOB ENDPOINTS ====================
+
+
+# Get the status and per-playlist progress of a conversion job
+@playlists_bp.route("/jobs/<job_id>")
+async def get_job_status(job_id):
+    # Jobs are only visible to the session that created them
+    job = await jobs.get_job(job_id, rate_limiter.user_key())
+    if job is None:
+        return jsonify({ "error": "Job not found" }), 404
+
+    return jsonify(job)
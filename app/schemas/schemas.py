@@ -5,6 +5,7 @@ class Track:
     id: str
     image: str
     name: str
+    isrc: str | None = None
 
 @dataclass
 class Playlist:
@@ -12,4 +13,5 @@ class Playlist:
     name: str
     description: str
     image: str
-    tracks: list[Track] = field(default_factory=list)
\ No newline at end of file
+    tracks: list[Track] = field(default_factory=list)
+    snapshot_id: str | None = None # Spotify's version of the playlist
\ No newline at end of file
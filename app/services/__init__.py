@@ -1,2 +1,4 @@
 from .spotify_service import SpotifyService
 from .youtube_service import YouTubeService
+from .conversion_service import ConversionService
+from .credential_service import CredentialService, RefreshFailed
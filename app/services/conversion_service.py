@@ -0,0 +1,254 @@
+from app.services.spotify_service import SpotifyService, FILL_BATCH_SIZE
+from app.services.youtube_service import YouTubeService
+from app.utils import checkpoints, playlist_map, track_map
+from contextlib import aclosing
+import aiohttp
+import asyncio
+
+# Most tracks inserted by one fill_playlist call while streaming
+# YouTube inserts one video per call anyway, so each insert is checkpointed on its own
+MAX_FILL_BATCH = {
+    SpotifyService: FILL_BATCH_SIZE,
+    YouTubeService: 1
+}
+
+# Insert errors caused by the tracks themselves rather than the playlist or the user
+TRACK_ERROR_STATUSES = (400, 404, 409)
+
+# Progress callback used when the caller does not track progress
+async def ignore_progress(index: int, **fields):
+    pass
+
+class ConversionService:
+    # Create playlists from the request body format of /playlists/<provider>/create with the
+    # target service's client. on_progress(index, **fields) is awaited as each playlist makes progress.
+    # With a request_key, progress is checkpointed and calling again with the same key
+    # resumes the conversion instead of repeating the work (see app/utils/checkpoints.py)
+    @staticmethod
+    async def create_spotify_playlists(spotify: SpotifyService, playlists: list[dict], on_progress=ignore_progress, request_key: str | None = None):
+        return await ConversionService._create_playlists(spotify, "youtube", "spotify", playlists, on_progress, request_key)
+
+    @staticmethod
+    async def create_youtube_playlists(youtube: YouTubeService, playlists: list[dict], on_progress=ignore_progress, request_key: str | None = None):
+        return await ConversionService._create_playlists(youtube, "spotify", "youtube", playlists, on_progress, request_key)
+
+    # Sync playlists converted before instead of creating them again
+    # Playlists with a source "id" that was converted (or synced) before only get the tracks
+    # added to or removed from the source since then. Other playlists are created as usual
+    @staticmethod
+    async def sync_spotify_playlists(spotify: SpotifyService, playlists: list[dict], on_progress=ignore_progress, request_key: str | None = None):
+        return await ConversionService._create_playlists(spotify, "youtube", "spotify", playlists, on_progress, request_key, sync=True)
+
+    @staticmethod
+    async def sync_youtube_playlists(youtube: YouTubeService, playlists: list[dict], on_progress=ignore_progress, request_key: str | None = None):
+        return await ConversionService._create_playlists(youtube, "spotify", "youtube", playlists, on_progress, request_key, sync=True)
+
+    # service is the target's client, source and target are the providers the playlists are converted from and to
+    @staticmethod
+    async def _create_playlists(service, source: str, target: str, playlists: list[dict], on_progress,
+                                request_key: str | None = None, sync: bool = False):
+        # Runs with the same key (e.g. a client retrying after a proxy timeout) would both
+        # create the playlists, so only one may run at a time
+        async with checkpoints.claim(request_key, playlists):
+            return await ConversionService._create_claimed_playlists(service, source, target, playlists, on_progress, request_key, sync)
+
+    @staticmethod
+    async def _create_claimed_playlists(service, source: str, target: str, playlists: list[dict], on_progress,
+                                        request_key: str | None, sync: bool):
+        playlist_checkpoints = await checkpoints.load_many(request_key, len(playlists))
+
+        mappings = {}
+        if sync:
+            mappings = await playlist_map.get_many(await service.account_id(), source, [playlist["id"] for playlist in playlists if playlist.get("id")], target)
+
+        async def _convert(index: int, playlist: dict):
+            checkpoint = playlist_checkpoints[index]
+            mapping = mappings.get(playlist.get("id"))
+            # A conversion this request already started is resumed rather than synced
+            if mapping is not None and checkpoint.playlist_id is None:
+                try:
+                    return await ConversionService._sync_playlist(service, source, target, index, playlist, mapping, on_progress)
+                except aiohttp.ClientResponseError as e:
+                    if e.status != 404:
+                        raise
+                    # The target playlist is gone, so convert it from scratch
+                    await playlist_map.delete(await service.account_id(), source, playlist["id"], target)
+            return await ConversionService._convert_playlist(service, source, target, index, playlist, checkpoint, on_progress)
+
+        return await asyncio.gather(*[_convert(index, playlist) for index, playlist in enumerate(playlists)])
+
+    # Bring a converted playlist up to date with its source
+    # Only the delta against the items it was last converted or synced with is removed and appended.
+    # Kept tracks stay where they are, so new tracks end up at the end of the playlist.
+    # The mapping is saved after the removal and after each inserted batch, so it doubles as the
+    # sync's checkpoint: an interrupted sync is never applied twice by the next one
+    @staticmethod
+    async def _sync_playlist(service, source: str, target: str, index: int, playlist: dict, mapping: dict, on_progress):
+        playlist_id = mapping["playlist_id"]
+        tracks = playlist["tracks"]
+        account_id = await service.account_id()
+
+        await on_progress(index, status="syncing", playlist_id=playlist_id)
+        track_ids = await service.search_tracks(tracks, source)
+
+        removed_item_ids, items, added = playlist_map.diff(mapping["items"], [track_id for track_id in track_ids if track_id is not None])
+        if removed_item_ids:
+            await service.remove_tracks(playlist_id, removed_item_ids)
+            await playlist_map.save(account_id, source, playlist["id"], target, playlist_id, items)
+
+        fill_results = []
+        tracks_added = 0
+        tracks_failed = 0
+        max_batch = MAX_FILL_BATCH[type(service)]
+        for start in range(0, len(added), max_batch):
+            batch = added[start:start + max_batch]
+            batch_fill_results, item_ids = await ConversionService._fill_playlist(service, playlist_id, batch)
+            fill_results += batch_fill_results
+
+            added_items = [(track_id, item_id) for track_id, item_id in zip(batch, item_ids) if item_id is not None]
+            items = items + added_items
+            await playlist_map.save(account_id, source, playlist["id"], target, playlist_id, items)
+            tracks_added += len(added_items)
+            tracks_failed += len(batch) - len(added_items)
+            await on_progress(index, tracks_added=tracks_added, tracks_failed=tracks_failed)
+
+        # Only remember tracks that are in the playlist, not ones the target rejected
+        in_playlist = {track_id for track_id, _ in items}
+        await track_map.save_many(source, target, [(track, track_id) for track, track_id in zip(tracks, track_ids) if track_id in in_playlist])
+
+        await on_progress(index, status="completed", tracks_added=tracks_added, tracks_removed=len(removed_item_ids))
+        return ConversionService._playlist_result(fill_results)
+
+    # Stream one playlist through create, search and fill without phase barriers
+    # The playlist is created while its tracks are searched, and every track is inserted
+    # as soon as it and all tracks before it have resolved, so positions are preserved.
+    # The created playlist and every resolved and inserted track are checkpointed, so a
+    # resumed conversion only searches and inserts what is left. Tracks that fail to insert
+    # are skipped, and the playlist is only checkpointed as completed once none are left.
+    # Tracks a resumed conversion inserts are appended after the ones already in the
+    # playlist, so tracks that failed before can end up out of their source order
+    @staticmethod
+    async def _convert_playlist(service, source: str, target: str, index: int, playlist: dict,
+                                checkpoint: checkpoints.Checkpoint, on_progress):
+        if checkpoint.result is not None:
+            await on_progress(index, status="completed", playlist_id=checkpoint.playlist_id, tracks_added=len(checkpoint.inserted))
+            return checkpoint.result
+
+        loop = asyncio.get_running_loop()
+        tracks = playlist["tracks"]
+        resolved = [loop.create_future() for _ in tracks]
+        for position, track_id in checkpoint.resolved.items():
+            resolved[position].set_result(track_id)
+
+        unresolved = [position for position in range(len(tracks)) if position not in checkpoint.resolved]
+
+        async def _search():
+            try:
+                async with aclosing(service.search_tracks_as_completed([tracks[position] for position in unresolved], source)) as results:
+                    async for position, track_id in results:
+                        resolved[unresolved[position]].set_result(track_id)
+            except Exception as e:
+                for future in resolved:
+                    if not future.done():
+                        future.set_exception(e)
+                raise
+
+        search_task = asyncio.create_task(_search())
+        try:
+            playlist_id = checkpoint.playlist_id
+            if playlist_id is None:
+                await on_progress(index, status="creating")
+                playlist_id = await service.create_playlist(playlist["name"], playlist["description"])
+                await checkpoint.save_playlist_id(playlist_id)
+
+            tracks_added = len(checkpoint.inserted)
+            tracks_failed = 0
+            await on_progress(index, status="filling", playlist_id=playlist_id, tracks_added=tracks_added)
+
+            max_batch = MAX_FILL_BATCH[type(service)]
+            position = 0
+            while position < len(resolved):
+                # Wait for the next track, then take every following track that is already resolved
+                batch = [(position, await resolved[position])]
+                position += 1
+                while position < len(resolved) and resolved[position].done() and len(batch) < max_batch:
+                    batch.append((position, resolved[position].result()))
+                    position += 1
+
+                # Search results are cached, but checkpoint them with the request too
+                await checkpoint.save_resolved({track_position: track_id for track_position, track_id in batch
+                                                if track_position not in checkpoint.resolved})
+
+                # Skip tracks the target service has no results for and tracks inserted before resuming
+                batch = [(track_position, track_id) for track_position, track_id in batch
+                         if track_id is not None and track_position not in checkpoint.inserted]
+                if not batch:
+                    continue
+
+                batch_track_ids = [track_id for _, track_id in batch]
+                batch_fill_results, item_ids = await ConversionService._fill_playlist(service, playlist_id, batch_track_ids)
+
+                inserted = {track_position: item_id for (track_position, _), item_id in zip(batch, item_ids) if item_id is not None}
+                await checkpoint.save_inserted(batch[0][0], inserted, batch_fill_results)
+                tracks_added += len(inserted)
+                tracks_failed += len(batch) - len(inserted)
+                await on_progress(index, tracks_added=tracks_added, tracks_failed=tracks_failed)
+
+                # Remember converted tracks so they are never searched again
+                # Tracks that failed to insert are left out, so they are searched again next time
+                await track_map.save_many(source, target, [(tracks[track_position], track_id) for track_position, track_id in batch
+                                                           if track_position in inserted])
+
+            await search_task
+        finally:
+            search_task.cancel()
+            if search_task.done() and not search_task.cancelled():
+                search_task.exception()
+            for future in resolved:
+                # Mark exceptions of abandoned futures as retrieved
+                if future.done() and not future.cancelled():
+                    future.exception()
+
+        # Remember the converted playlist so it can be synced later
+        if playlist.get("id"):
+            items = [(checkpoint.resolved[track_position], checkpoint.inserted[track_position]) for track_position in sorted(checkpoint.inserted)]
+            await playlist_map.save(await service.account_id(), source, playlist["id"], target, playlist_id, items)
+
+        # Include batches inserted by earlier attempts of a resumed conversion
+        result = ConversionService._playlist_result(checkpoint.fill_results())
+
+        # Failed tracks are retried when the request is resumed
+        if tracks_failed == 0:
+            await checkpoint.complete(result)
+        await on_progress(index, status="completed")
+        return result
+
+    # A playlist's result from the fill results of its inserted batches
+    # YouTube returns one result per inserted item, Spotify one snapshot per call
+    @staticmethod
+    def _playlist_result(fill_results: list):
+        if fill_results and not isinstance(fill_results[-1], list):
+            return fill_results[-1]
+        return [item for fill_result in fill_results for item in fill_result]
+
+    # Insert tracks, isolating failures to the tracks that caused them
+    # A batch rejected as a whole (Spotify inserts a batch all or nothing) is retried one
+    # track at a time. Returns (fill results, item id of each track or None if it failed)
+    @staticmethod
+    async def _fill_playlist(service, playlist_id: str, track_ids: list[str]):
+        try:
+            fill_result = await service.fill_playlist(playlist_id, track_ids)
+            return [fill_result], service.item_ids(track_ids, fill_result)
+        except aiohttp.ClientResponseError as e:
+            if e.status not in TRACK_ERROR_STATUSES:
+                raise
+            if len(track_ids) == 1:
+                return [], [None]
+
+        fill_results = []
+        item_ids = []
+        for track_id in track_ids:
+            track_fill_results, track_item_ids = await ConversionService._fill_playlist(service, playlist_id, [track_id])
+            fill_results += track_fill_results
+            item_ids += track_item_ids
+        return fill_results, item_ids
@@ -0,0 +1,112 @@
+import logging
+from flask import session
+from app.config import config
+from app.utils import get_session
+from app.utils import rate_limiter, singleflight
+import aiohttp
+import datetime
+import os
+
+SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
+SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+settings = config["default"]
+
+# The refresh token was rejected (revoked or expired), so the user has to log in again
+class RefreshFailed(Exception):
+    def __init__(self, provider: str, status: int):
+        super().__init__(f"Refreshing {provider} credentials failed with {status}")
+        self.provider = provider
+        self.status = status
+
+class CredentialService:
+    # Make sure the session's credentials stay valid for at least TOKEN_REFRESH_MARGIN seconds,
+    # refreshing them inside the current request (no redirect). Returns the credentials
+    @staticmethod
+    async def ensure_spotify():
+        credentials = await CredentialService.refresh_spotify(session["spotify_credentials"])
+        if credentials is not session["spotify_credentials"]:
+            session["spotify_credentials"] = credentials
+        return credentials
+
+    @staticmethod
+    async def ensure_youtube():
+        credentials = await CredentialService.refresh_youtube(session["youtube_credentials"])
+        if credentials is not session["youtube_credentials"]:
+            session["youtube_credentials"] = credentials
+        return credentials
+
+    # Return credentials refreshed with the pooled HTTP client if they expire within
+    # TOKEN_REFRESH_MARGIN seconds, otherwise the same credentials. Concurrent refreshes of
+    # the same user share one call. Needs no request context, so the worker uses it too
+    @staticmethod
+    async def refresh_spotify(credentials: dict):
+        if credentials["expires_at"] - settings.TOKEN_REFRESH_MARGIN > datetime.datetime.now().timestamp():
+            return credentials
+
+        key = f"token_refresh:spotify:{rate_limiter.user_key()}"
+        refreshed = await singleflight.do(key, lambda: CredentialService._request_spotify_token(credentials["refresh_token"]), distributed=True)
+        return { **credentials, **refreshed }
+
+    @staticmethod
+    async def refresh_youtube(credentials: dict):
+        # Google credentials store their expiry as naive UTC
+        expiry = datetime.datetime.fromisoformat(credentials["expiry"])
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        if expiry - datetime.timedelta(seconds=settings.TOKEN_REFRESH_MARGIN) > now:
+            return credentials
+
+        key = f"token_refresh:youtube:{rate_limiter.user_key()}"
+        refreshed = await singleflight.do(key, lambda: CredentialService._request_youtube_token(credentials), distributed=True)
+        return { **credentials, **refreshed }
+
+    @staticmethod
+    async def _request_spotify_token(refresh_token: str):
+        body = {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": SPOTIFY_CLIENT_ID,
+            "client_secret": SPOTIFY_CLIENT_SECRET
+        }
+        token_info = await CredentialService._post_token("spotify", SPOTIFY_TOKEN_URL, body)
+
+        refreshed = {
+            "access_token": token_info["access_token"],
+            "expires_at": datetime.datetime.now().timestamp() + token_info["expires_in"]
+        }
+        # Spotify may rotate the refresh token
+        if "refresh_token" in token_info:
+            refreshed["refresh_token"] = token_info["refresh_token"]
+        return refreshed
+
+    @staticmethod
+    async def _request_youtube_token(credentials: dict):
+        body = {
+            "grant_type": "refresh_token",
+            "refresh_token": credentials["refresh_token"],
+            "client_id": credentials["client_id"],
+            "client_secret": credentials["client_secret"]
+        }
+        token_info = await CredentialService._post_token("youtube", credentials["token_uri"], body)
+
+        expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(seconds=token_info["expires_in"])
+        return {
+            "token": token_info["access_token"],
+            "expiry": expiry.isoformat()
+        }
+
+    @staticmethod
+    async def _post_token(provider: str, url: str, body: dict):
+        try:
+            async with get_session().post(url, data=body, raise_for_status=True) as response:
+                return await response.json()
+        except aiohttp.ClientResponseError as e:
+            logging.error(f"Error in CredentialService.refresh_{provider}: {e.status} {e.message}")
+            # invalid_grant and invalid_client
+            if e.status in (400, 401):
+                raise RefreshFailed(provider, e.status)
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error in CredentialService.refresh_{provider}: {e}")
+            raise
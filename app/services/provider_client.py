@@ -0,0 +1,51 @@
+from app.utils import get_session, fetch_cache, set_cache
+from app.utils import rate_limiter, singleflight
+import aiohttp
+import asyncio
+import hashlib
+
+# Access tokens live for an hour, and so does the account id cached for one
+ACCOUNT_ID_TTL = 60 * 60 # seconds
+
+# Base of the provider clients (SpotifyService, YouTubeService)
+# A client is created once per request (or job) for one user
+# Subclasses set provider and implement _fetch_account_id()
+class ProviderClient:
+    provider: str
+
+    def __init__(self, access_token: str):
+        self.access_token = access_token
+        self.user = rate_limiter.user_key()
+        self._account_id = None
+        self._http = None
+        self._loop = None
+
+    # The pooled HTTP session of the running loop
+    # Streamed responses can run on another loop than the view under the dev server
+    @property
+    def http(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._http, self._loop = get_session(), loop
+        return self._http
+
+    # Id of the provider account (Spotify user id, YouTube channel id)
+    # Unlike the user key (a session id) it stays the same across logins, so data kept
+    # for longer than a session is keyed by it. Looked up once per client, and cached in
+    # Redis per access token so later requests with the same token skip the lookup
+    async def account_id(self) -> str:
+        if self._account_id is None:
+            self._account_id = await singleflight.do(f"{self.provider}_account_id:{self.user}", self._get_account_id)
+        return self._account_id
+
+    async def _get_account_id(self) -> str:
+        token_hash = hashlib.sha256(self.access_token.encode("utf-8")).hexdigest()
+        key = f"account_id:{self.provider}:{token_hash}"
+
+        cached = await fetch_cache(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+
+        account_id = await self._fetch_account_id()
+        await set_cache(key, account_id, ACCOUNT_ID_TTL)
+        return account_id
@@ -1,30 +1,121 @@
 import logging
-from flask import session
 from app.schemas import Playlist, Track
+from app.config import config
+from app.services.provider_client import ProviderClient
+from app.utils import library_cache, metrics, rate_limiter, singleflight, track_map
+from app.utils.batching import map_chunks
+from app.utils.concurrency import AdaptiveLimiter
+from app.utils.pagination import paginate_offset
+from app.utils.retry import NON_IDEMPOTENT_RETRYABLE_STATUSES, RetryPolicy
+from contextlib import aclosing
 import aiohttp
-import asyncio
+import dataclasses
+import re
 
 API_BASE_URL = "https://api.spotify.com/v1"
+PLAYLISTS_PAGE_SIZE = 50 # max allowed by /me/playlists
+TRACKS_PAGE_SIZE = 100 # max allowed by /playlists/{id}/tracks
+FILL_BATCH_SIZE = 100 # max uris per POST /playlists/{id}/tracks
 
-async def fetch_data(url, params=None, headers=None):
-    async with aiohttp.ClientSession(raise_for_status=True) as session:
-        async with session.get(url, params=params, headers=headers) as response:
-            return await response.json()
-        
-async def post(url, json=None, headers=None):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url=url, json=json, headers=headers) as response:
-            return await response.json()
+settings = config["default"]
+
+# Every Spotify call goes through this limiter
+limiter = AdaptiveLimiter(
+    "spotify",
+    initial=settings.SPOTIFY_CONCURRENCY_INITIAL,
+    minimum=settings.SPOTIFY_CONCURRENCY_MIN,
+    maximum=settings.SPOTIFY_CONCURRENCY_MAX
+)
+
+retry_policy = RetryPolicy(
+    max_attempts=settings.RETRY_MAX_ATTEMPTS,
+    base_delay=settings.RETRY_BASE_DELAY,
+    max_delay=settings.RETRY_MAX_DELAY,
+    max_elapsed=settings.RETRY_MAX_ELAPSED
+)
+
+# POSTs (playlist creates and track appends) are not idempotent
+post_retry_policy = RetryPolicy(
+    max_attempts=settings.RETRY_MAX_ATTEMPTS,
+    base_delay=settings.RETRY_BASE_DELAY,
+    max_delay=settings.RETRY_MAX_DELAY,
+    max_elapsed=settings.RETRY_MAX_ELAPSED,
+    retryable_statuses=NON_IDEMPOTENT_RETRYABLE_STATUSES
+)
+
+# Metrics label of an API url, with ids left out so labels stay few
+def _endpoint(url: str) -> str:
+    return re.sub(r"/(playlists|users)/[^/]+", r"/\1/{id}", url.removeprefix(API_BASE_URL))
+
+@retry_policy
+async def fetch_data(http: aiohttp.ClientSession, url, params=None, headers=None):
+    async with limiter.slot():
+        await rate_limiter.acquire("spotify")
+        with metrics.upstream_call("spotify", "GET", _endpoint(url)) as call:
+            async with http.get(url, params=params, headers=headers, raise_for_status=True) as response:
+                call.status = response.status
+                return await response.json()
+
+@post_retry_policy
+async def post(http: aiohttp.ClientSession, url, json=None, headers=None):
+    async with limiter.slot():
+        await rate_limiter.acquire("spotify")
+        with metrics.upstream_call("spotify", "POST", _endpoint(url)) as call:
+            async with http.post(url=url, json=json, headers=headers, raise_for_status=True) as response:
+                call.status = response.status
+                return await response.json()
+
+@retry_policy
+async def delete(http: aiohttp.ClientSession, url, json=None, headers=None):
+    async with limiter.slot():
+        await rate_limiter.acquire("spotify")
+        with metrics.upstream_call("spotify", "DELETE", _endpoint(url)) as call:
+            async with http.delete(url=url, json=json, headers=headers, raise_for_status=True) as response:
+                call.status = response.status
+                return await response.json()
+
+# Client for one user's Spotify account, created once per request (or job) from its credentials
+# Holds everything calls need, so they never go back to the Flask session and the client
+# works outside a request too (see worker.py)
+class SpotifyService(ProviderClient):
+    provider = "spotify"
+
+    def __init__(self, credentials: dict):
+        super().__init__(credentials["access_token"])
+        self.credentials = credentials
+        self.headers = {"Authorization": f"Bearer {credentials['access_token']}"}
+
+    # The Spotify user id (see ProviderClient.account_id)
+    async def _fetch_account_id(self):
+        user_response = await fetch_data(self.http, f"{API_BASE_URL}/me", headers=self.headers)
+        return user_response["id"]
 
-class SpotifyService:
     # Get all playlists
-    @staticmethod
-    async def get_playlists():
-        token = session["spotify_credentials"]["access_token"]
-        headers = {"Authorization": f"Bearer {token}"}
+    # Concurrent listings for the same user share one upstream call
+    async def get_playlists(self):
+        return await singleflight.do(f"spotify_playlists:{self.user}", self._get_playlists)
+
+    async def _get_playlists(self):
+        playlists = [playlist async for playlist in self.iter_playlists()]
+        return { "playlists" : playlists }
+
+    # Iterate over all playlists, fetching pages concurrently
+    async def iter_playlists(self):
+        async def _fetch_page(offset: int, limit: int):
+            params = { "offset": offset, "limit": limit }
+            response = await fetch_data(self.http, f"{API_BASE_URL}/me/playlists", params=params, headers=self.headers)
+            return response["items"], response["total"]
 
         try:
-            response = await fetch_data(f"{API_BASE_URL}/me/playlists", headers=headers)
+            async with aclosing(paginate_offset(_fetch_page, PLAYLISTS_PAGE_SIZE)) as items:
+                async for item in items:
+                    yield Playlist(**{
+                        "id": item["id"],
+                        "name": item["name"],
+                        "description": item["description"],
+                        "image": item["images"][0]["url"],
+                        "snapshot_id": item["snapshot_id"]
+                    })
         except aiohttp.ClientResponseError as e:
             logging.error(f"Error in SpotifyService.get_playlists: {e.status} {e.message}")
             raise
@@ -32,62 +123,103 @@ class SpotifyService:
             logging.error(f"Unexpected error in SpotifyService.get_playlists: {e}")
             raise
 
-        playlists = [Playlist(**{
-            "id": item["id"],
-            "name": item["name"],
-            "description": item["description"],
-            "image": item["images"][0]["url"]
-        }) for item in response["items"]]
+    # Get a playlist's tracks
+    # Concurrent listings of the same playlist for the same user share one upstream call.
+    # Tracks are cached per user with the playlist's snapshot_id and only refetched once it
+    # changes. Pass the snapshot_id from get_playlists() to skip looking it up
+    async def get_playlist_tracks(self, playlist_id, snapshot_id: str | None = None):
+        key = f"spotify_playlist_tracks:{self.user}:{playlist_id}"
+        return await singleflight.do(key, lambda: self._get_playlist_tracks(playlist_id, snapshot_id))
 
-        return { "playlists" : playlists }
+    async def _get_playlist_tracks(self, playlist_id, snapshot_id: str | None = None):
+        async def _fetch(cached_snapshot_id: str | None):
+            # Looked up before the tracks, so a change in between is caught on the next call
+            current_snapshot_id = snapshot_id or await self._get_snapshot_id(playlist_id)
+            if current_snapshot_id == cached_snapshot_id:
+                return None
 
-    # Get a playlist's tracks
-    @staticmethod
-    async def get_playlist_tracks(playlist_id):
-        token = session["spotify_credentials"]["access_token"]
-        headers = {"Authorization": f"Bearer {token}"}
+            tracks = [dataclasses.asdict(track) async for track in self.iter_playlist_tracks(playlist_id)]
+            return current_snapshot_id, tracks
+
+        tracks = await library_cache.revalidate("spotify", await self.account_id(), f"tracks:{playlist_id}", _fetch)
+        return [Track(**track) for track in tracks]
+
+    async def _get_snapshot_id(self, playlist_id):
+        try:
+            params = { "fields": "snapshot_id" }
+            response = await fetch_data(self.http, f"{API_BASE_URL}/playlists/{playlist_id}", params=params, headers=self.headers)
+            return response["snapshot_id"]
+        except aiohttp.ClientResponseError as e:
+            logging.error(f"Error in SpotifyService.get_playlist_tracks: {e.status} {e.message}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error in SpotifyService.get_playlist_tracks: {e}")
+            raise
+
+    # Iterate over all of a playlist's tracks, fetching pages concurrently
+    async def iter_playlist_tracks(self, playlist_id):
+        async def _fetch_page(offset: int, limit: int):
+            return await self._fetch_tracks_page(playlist_id, offset, limit)
 
         try:
-            response = await fetch_data(f"{API_BASE_URL}/playlists/{playlist_id}/tracks", headers=headers)
+            async with aclosing(paginate_offset(_fetch_page, TRACKS_PAGE_SIZE)) as items:
+                async for item in items:
+                    # Tracks removed from Spotify are listed without a track object
+                    if item["track"] is None:
+                        continue
+                    yield self._to_track(item["track"])
         except aiohttp.ClientResponseError as e:
             logging.error(f"Error in SpotifyService.get_playlist_tracks: {e.status} {e.message}")
             raise
         except Exception as e:
             logging.error(f"Unexpected error in SpotifyService.get_playlist_tracks: {e}")
             raise
-    
-        tracks: list[Track] = []
-        for item in response["items"]:
-            track = item["track"]
-            artists = []
 
-            for artist in track["artists"]:
-                artists.append(artist["name"])
+    # Get one page of a playlist's tracks (one upstream call)
+    # Returns (tracks, offset of the next page or None on the last page)
+    async def get_playlist_tracks_page(self, playlist_id, offset: int = 0, limit: int = TRACKS_PAGE_SIZE):
+        try:
+            items, total = await self._fetch_tracks_page(playlist_id, offset, limit)
+            tracks = [self._to_track(item["track"]) for item in items if item["track"] is not None]
 
-            new_track = Track(**{
-                "id": track["id"],
-                "image": track["album"]["images"][0]["url"],
-                "name": f"{", ".join(artists)} - {track["name"]}"
-            })
-            tracks.append(new_track)
+            next_offset = offset + limit
+            return tracks, next_offset if next_offset < total else None
+        except aiohttp.ClientResponseError as e:
+            logging.error(f"Error in SpotifyService.get_playlist_tracks_page: {e.status} {e.message}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error in SpotifyService.get_playlist_tracks_page: {e}")
+            raise
 
-        return tracks
+    # Returns (items, total)
+    async def _fetch_tracks_page(self, playlist_id, offset: int, limit: int):
+        params = { "offset": offset, "limit": limit }
+        response = await fetch_data(self.http, f"{API_BASE_URL}/playlists/{playlist_id}/tracks", params=params, headers=self.headers)
+        return response["items"], response["total"]
 
-    # Create a playlist and return its id
     @staticmethod
-    async def create_playlist(name: str, description: str):
-        token = session["spotify_credentials"]["access_token"]
-        headers = {"Authorization": f"Bearer {token}"}
+    def _to_track(track):
+        artists = []
+        for artist in track["artists"]:
+            artists.append(artist["name"])
 
+        return Track(**{
+            "id": track["id"],
+            "image": track["album"]["images"][0]["url"],
+            "name": f"{", ".join(artists)} - {track["name"]}",
+            "isrc": track.get("external_ids", {}).get("isrc")
+        })
+
+    # Create a playlist and return its id
+    async def create_playlist(self, name: str, description: str):
         try:
-            user_response = await fetch_data(f"{API_BASE_URL}/me", headers=headers)
-            user_id = user_response["id"]
+            user_id = await self.account_id()
 
             body = {
                 "name": name,
                 "description": description
             }
-            response = await post(f"{API_BASE_URL}/users/{user_id}/playlists", json=body, headers=headers)
+            response = await post(self.http, f"{API_BASE_URL}/users/{user_id}/playlists", json=body, headers=self.headers)
             return response["id"]
         
         except aiohttp.ClientResponseError as e:
@@ -96,29 +228,38 @@ class SpotifyService:
         except Exception as e:
             logging.error(f"Unexpected error in SpotifyService.create_playlist: {e}")
             raise
-  
-    # Search for tracks and return a list of each track's uri
+
+    # Search for tracks and return a list of each track's uri (None if not found)
     # track uri is used for inserting tracks into playlists in fill_playlist()
-    @staticmethod
-    async def search_tracks(tracks: list[str]):
-        token = session["spotify_credentials"]["access_token"]
-        headers = {"Authorization": f"Bearer {token}"}
+    # tracks are in the request body format of /playlists/spotify/create ("name", optional "id" and "isrc")
+    # and source is the provider their ids belong to, used to skip searching tracks converted before
+    async def search_tracks(self, tracks: list[dict], source: str | None = None):
+        track_uris = [None] * len(tracks)
+        async with aclosing(self.search_tracks_as_completed(tracks, source)) as results:
+            async for position, track_uri in results:
+                track_uris[position] = track_uri
+
+        return track_uris
+
+    # Search for tracks and yield (position, uri) as soon as each one resolves
+    # uri is None for tracks Spotify has no results for
+    async def search_tracks_as_completed(self, tracks: list[dict], source: str | None = None):
+        async def _search_track(track: str):
+            params = {
+                "q": track,
+                "type": ["track"],
+                "limit": 1
+            }
+            response = await fetch_data(self.http, f"{API_BASE_URL}/search", params=params, headers=self.headers)
 
+            if not response["tracks"]["items"]:
+                return None
+            return response["tracks"]["items"][0]["uri"]
 
         try:
-            tasks = []
-            for track in tracks:
-                params = {
-                    "q": track,
-                    "type": ["track"],
-                    "limit": 1
-                }
-                tasks.append(fetch_data(f"{API_BASE_URL}/search", params=params, headers=headers))
-            
-            responses = await asyncio.gather(*tasks)
-            track_uris = [response["tracks"]["items"][0]["uri"] for response in responses]
-            return track_uris
-        
+            async with aclosing(track_map.resolve_as_completed(source, "spotify", tracks, _search_track)) as results:
+                async for position, track_uri in results:
+                    yield position, track_uri
         except aiohttp.ClientResponseError as e:
             logging.error(f"Error in SpotifyService.search_tracks: {e.status} {e.message}")
             raise
@@ -127,19 +268,42 @@ class SpotifyService:
             raise
   
     # Add tracks to playlist
-    @staticmethod
-    async def fill_playlist(playlist_id: str, track_uris: list[str]):
-        token = session["spotify_credentials"]["access_token"]
-        headers = {"Authorization": f"Bearer {token}"}
+    async def fill_playlist(self, playlist_id: str, track_uris: list[str]):
+        async def _add_chunk(chunk: list[str]):
+            body = { "uris": chunk }
+            return await post(self.http, f"{API_BASE_URL}/playlists/{playlist_id}/tracks", json=body, headers=self.headers)
 
         try:
-            body = { "uris": track_uris }
-            response = await post(f"{API_BASE_URL}/playlists/{playlist_id}/tracks", json=body, headers=headers)
-            return response
+            # Appends must happen in order to keep track positions
+            responses = await map_chunks(_add_chunk, track_uris, FILL_BATCH_SIZE, ordered=True)
+
+            # Each response holds the playlist's snapshot_id after that chunk, so the last one is current
+            return responses[-1] if responses else {}
         
         except aiohttp.ClientResponseError as e:
             logging.error(f"Error in SpotifyService.fill_playlist: {e.status} {e.message}")
             raise
         except Exception as e:
             logging.error(f"Unexpected error in SpotifyService.fill_playlist: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    # Remove tracks from a playlist by uri (every copy of each uri is removed)
+    async def remove_tracks(self, playlist_id: str, track_uris: list[str]):
+        async def _remove_chunk(chunk: list[str]):
+            body = { "tracks": [{ "uri": uri } for uri in chunk] }
+            return await delete(self.http, f"{API_BASE_URL}/playlists/{playlist_id}/tracks", json=body, headers=self.headers)
+
+        try:
+            responses = await map_chunks(_remove_chunk, track_uris, FILL_BATCH_SIZE, ordered=True)
+            return responses[-1] if responses else {}
+        except aiohttp.ClientResponseError as e:
+            logging.error(f"Error in SpotifyService.remove_tracks: {e.status} {e.message}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error in SpotifyService.remove_tracks: {e}")
+            raise
+
+    # Item id of each track fill_playlist() added. Spotify removes tracks by uri
+    @staticmethod
+    def item_ids(track_uris: list[str], fill_result) -> list[str | None]:
+        return list(track_uris)
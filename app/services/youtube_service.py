@@ -1,62 +1,158 @@
-from flask import session
 from google.oauth2.credentials import Credentials
 from app.schemas import Playlist, Track
-from app.utils import fetch_cache, set_cache
+from app.config import config
+from app.services.provider_client import ProviderClient
+from app.utils import checkpoints, library_cache, metrics, playlist_map, quota, singleflight, search_cache, track_map, video_cache
+from app.utils import rate_limiter
+from app.utils.batching import map_chunks
+from app.utils.concurrency import AdaptiveLimiter
+from app.utils.pagination import paginate_token
+from app.utils.retry import NON_IDEMPOTENT_RETRYABLE_STATUSES, RetryPolicy
+from contextlib import aclosing
 import aiohttp
-import asyncio
+import dataclasses
 import logging
-import time
 import json
 
 # YouTube API info
 API_BASE_URL = "https://www.googleapis.com/youtube/v3"
 API_SERVICE_NAME = "youtube"
 API_VERSION = "v3"
+PAGE_SIZE = 50 # max allowed by list endpoints
+VIDEOS_BATCH_SIZE = 50 # max ids per videos.list call
+
+settings = config["default"]
+
+# Every YouTube call goes through this limiter
+limiter = AdaptiveLimiter(
+    "youtube",
+    initial=settings.YOUTUBE_CONCURRENCY_INITIAL,
+    minimum=settings.YOUTUBE_CONCURRENCY_MIN,
+    maximum=settings.YOUTUBE_CONCURRENCY_MAX
+)
+
+QUOTA_EXCEEDED_MESSAGE = "Quota Exceeded"
+
+retry_policy = RetryPolicy(
+    max_attempts=settings.RETRY_MAX_ATTEMPTS,
+    base_delay=settings.RETRY_BASE_DELAY,
+    max_delay=settings.RETRY_MAX_DELAY,
+    max_elapsed=settings.RETRY_MAX_ELAPSED,
+    # The daily quota does not come back within a retry window
+    give_up=lambda e: getattr(e, "message", None) == QUOTA_EXCEEDED_MESSAGE
+)
+
+# POSTs (playlists.insert and playlistItems.insert) are not idempotent
+post_retry_policy = RetryPolicy(
+    max_attempts=settings.RETRY_MAX_ATTEMPTS,
+    base_delay=settings.RETRY_BASE_DELAY,
+    max_delay=settings.RETRY_MAX_DELAY,
+    max_elapsed=settings.RETRY_MAX_ELAPSED,
+    retryable_statuses=NON_IDEMPOTENT_RETRYABLE_STATUSES,
+    give_up=lambda e: getattr(e, "message", None) == QUOTA_EXCEEDED_MESSAGE
+)
+
+# With an etag the request is conditional, and None is returned if the resource is unchanged
+@retry_policy
+async def fetch_data(http: aiohttp.ClientSession, url, params=None, headers=None, cost=quota.LIST_COST, etag=None):
+    if etag is not None:
+        headers = {**(headers or {}), "If-None-Match": etag}
+
+    async with limiter.slot():
+        await rate_limiter.acquire("youtube")
+        await quota.record(cost)
+        with metrics.upstream_call("youtube", "GET", url.removeprefix(API_BASE_URL)) as call:
+            async with http.get(url, params=params, headers=headers) as response:
+                call.status = response.status
+                if response.status == 304:
+                    return None
+                try:
+                    data = await response.json()
+                    if response.status == 200:
+                        return data
+                    else:
+                        response.raise_for_status() # caught by except below
+                except aiohttp.ClientResponseError as e:
+                    if e.status == 403 and "quotaExceeded" in str(data):
+                        # Re-raise rate limit error as 429 to standardize across different music services
+                        raise aiohttp.ClientResponseError(
+                            request_info=response.request_info,
+                            history=response.history,
+                            status=429,
+                            message=QUOTA_EXCEEDED_MESSAGE,
+                            headers=response.headers
+                        )
+                    else:
+                        response.raise_for_status()
+
+
+@post_retry_policy
+async def post(http: aiohttp.ClientSession, url, params=None, headers=None, json=None, cost=quota.INSERT_COST):
+    async with limiter.slot():
+        await rate_limiter.acquire("youtube")
+        await quota.record(cost)
+        with metrics.upstream_call("youtube", "POST", url.removeprefix(API_BASE_URL)) as call:
+            async with http.post(url=url, params=params, headers=headers, json=json) as response:
+                call.status = response.status
+                try:
+                    data = await response.json()
+                    if response.status == 200:
+                        return data
+                    else:
+                        response.raise_for_status() # caught by except below
+                except aiohttp.ClientResponseError as e:
+                    if e.status == 403 and "quotaExceeded" in str(data):
+                        # Re-raise rate limit error as 429 to standardize across different music services
+                        raise aiohttp.ClientResponseError(
+                            request_info=response.request_info,
+                            history=response.history,
+                            status=429,
+                            message=QUOTA_EXCEEDED_MESSAGE,
+                            headers=response.headers
+                        )
+                    else:
+                        response.raise_for_status()
+
+@retry_policy
+async def delete(http: aiohttp.ClientSession, url, params=None, headers=None, cost=quota.DELETE_COST):
+    async with limiter.slot():
+        await rate_limiter.acquire("youtube")
+        await quota.record(cost)
+        with metrics.upstream_call("youtube", "DELETE", url.removeprefix(API_BASE_URL)) as call:
+            async with http.delete(url=url, params=params, headers=headers, raise_for_status=True) as response:
+                call.status = response.status
+                return None
+
+# Client for one user's YouTube account, created once per request (or job) from its credentials
+# The credentials are parsed and the headers built once instead of on every call (and every
+# search), and the client works outside a request too (see worker.py)
+class YouTubeService(ProviderClient):
+    provider = "youtube"
+
+    def __init__(self, credentials: dict):
+        super().__init__(credentials["token"])
+        self.credentials = Credentials.from_authorized_user_info(credentials)
+        self.headers = {
+            "Authorization": f"Bearer {self.credentials.token}",
+            "Accept": "application/json"
+        }
+        self.json_headers = {
+            "Authorization": f"Bearer {self.credentials.token}",
+            "Content-Type": "application/json"
+        }
+
+    # The id of the user's channel (see ProviderClient.account_id)
+    async def _fetch_account_id(self):
+        url = f"{API_BASE_URL}/channels" # quota cost per call: 1
+        params = {
+            "part": "id",
+            "mine": "true"
+        }
+        response = await fetch_data(self.http, url, params, self.headers)
+        if not response["items"]:
+            raise ValueError("The YouTube account has no channel")
+        return response["items"][0]["id"]
 
-async def fetch_data(url, params=None, headers=None):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params, headers=headers) as response:
-            try:
-                data = await response.json()
-                if response.status == 200:
-                    return data
-                else:
-                    response.raise_for_status() # caught by except below
-            except aiohttp.ClientResponseError as e:
-                if e.status == 403 and "quotaExceeded" in str(data):
-                    # Re-raise rate limit error as 429 to standardize across different music services
-                    raise aiohttp.ClientResponseError(
-                        request_info=response.request_info,
-                        history=response.history,
-                        status=429,
-                        message="Rate Limit Exceeded"
-                    )
-                else:
-                    response.raise_for_status()
-
-
-async def post(url, params=None, headers=None, json=None):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url=url, params=params, headers=headers, json=json) as response:
-            try:
-                data = await response.json()
-                if response.status == 200:
-                    return data
-                else:
-                    response.raise_for_status() # caught by except below
-            except aiohttp.ClientResponseError as e:
-                if e.status == 403 and "quotaExceeded" in str(data):
-                    # Re-raise rate limit error as 429 to standardize across different music services
-                    raise aiohttp.ClientResponseError(
-                        request_info=response.request_info,
-                        history=response.history,
-                        status=429,
-                        message="Rate Limit Exceeded"
-                    )
-                else:
-                    response.raise_for_status()
-
-class YouTubeService:
     # Turn Credentials from oauth flow to a dictionary
     @staticmethod
     def format_credentials(credentials):
@@ -70,63 +166,166 @@ class YouTubeService:
             "expiry": credentials.expiry.isoformat()
         }
 
-    # Get all of user's playlists
+    # Estimate the quota cost of creating playlists (request body format of /playlists/youtube/create)
+    # Tracks already mapped from source or in the search cache cost nothing to resolve, and
+    # with a request_key, work checkpointed by an earlier attempt of the request costs nothing
     @staticmethod
-    async def get_playlists():
-        # YouTube API client
-        credentials = Credentials.from_authorized_user_info(session["youtube_credentials"])
-        access_token = credentials.token
+    async def estimate_create_cost(playlists: list[dict], source: str | None = None, request_key: str | None = None):
+        playlist_checkpoints = await checkpoints.load_many(request_key, len(playlists))
+
+        created_count = 0
+        inserted_count = 0
+        tracks = [] # tracks left to resolve
+        for playlist, checkpoint in zip(playlists, playlist_checkpoints):
+            if checkpoint.result is not None:
+                continue
+            if checkpoint.playlist_id is None:
+                created_count += 1
 
+            for position, track in enumerate(playlist["tracks"]):
+                # Already inserted, or resolved to no result
+                if position in checkpoint.inserted or (position in checkpoint.resolved and checkpoint.resolved[position] is None):
+                    continue
+                inserted_count += 1
+                if position not in checkpoint.resolved:
+                    tracks.append(track)
+
+        mapped = await track_map.get_many(source, tracks, "youtube") if source else {}
+
+        unique_tracks = list(dict.fromkeys(track["name"] for position, track in enumerate(tracks) if position not in mapped))
+        cached_video_ids = await search_cache.get_many("youtube", unique_tracks)
+        missed_count = len(unique_tracks) - len(cached_video_ids)
+
+        return (created_count * quota.INSERT_COST # playlists.insert
+                + missed_count * quota.SEARCH_COST # search.list
+                + inserted_count * quota.INSERT_COST) # playlistItems.insert
+
+    # Estimate the quota cost of syncing playlists (see ConversionService.sync_youtube_playlists)
+    # Playlists synced before cost their delta. Tracks not mapped yet are counted as both
+    # a search (unless cached) and an insert, so this is an upper bound
+    async def estimate_sync_cost(self, playlists: list[dict], source: str):
+        mappings = await playlist_map.get_many(await self.account_id(), source, [playlist["id"] for playlist in playlists if playlist.get("id")], "youtube")
+        cost = await YouTubeService.estimate_create_cost([playlist for playlist in playlists if playlist.get("id") not in mappings], source)
+
+        for playlist in playlists:
+            mapping = mappings.get(playlist.get("id"))
+            if mapping is None:
+                continue
+
+            tracks = playlist["tracks"]
+            mapped = await track_map.get_many(source, tracks, "youtube")
+            unmapped_tracks = list(dict.fromkeys(track["name"] for position, track in enumerate(tracks) if position not in mapped))
+            cached_video_ids = await search_cache.get_many("youtube", unmapped_tracks)
+            removed_item_ids, _, added = playlist_map.diff(mapping["items"], [mapped[position] for position in sorted(mapped)])
+
+            cost += ((len(unmapped_tracks) - len(cached_video_ids)) * quota.SEARCH_COST # search.list
+                     + len(removed_item_ids) * quota.DELETE_COST # playlistItems.delete
+                     + (len(added) + len(tracks) - len(mapped)) * quota.INSERT_COST) # playlistItems.insert
+        return cost
+
+    # Get all of user's playlists
+    # Concurrent listings for the same user share one upstream call
+    async def get_playlists(self):
+        return await singleflight.do(f"youtube_playlists:{self.user}", self._get_playlists)
+
+    async def _get_playlists(self):
+        playlists = [playlist async for playlist in self.iter_playlists()]
+        return { "playlists": playlists }
+
+    # Iterate over all of user's playlists, fetching the next page while the current one is consumed
+    async def iter_playlists(self):
         url = f"{API_BASE_URL}/playlists" # quota cost per call: 1
-        params = {
-            "part": "snippet",
-            "mine": "true",
-            "maxResults": 50,
-        }
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Accept": "application/json",
-        }
+
+        # Pages are cached with their ETag and revalidated with conditional requests
+        async def _fetch_page(page_token: str | None):
+            params = {
+                "part": "snippet",
+                "mine": "true",
+                "maxResults": PAGE_SIZE,
+            }
+            if page_token:
+                params["pageToken"] = page_token
+
+            async def _fetch(etag: str | None):
+                response = await fetch_data(self.http, url, params, self.headers, etag=etag)
+                if response is None:
+                    return None
+                return response["etag"], { "items": response["items"], "next": response.get("nextPageToken") }
+
+            page = await library_cache.revalidate("youtube", await self.account_id(), f"playlists:{page_token or ''}", _fetch)
+            return page["items"], page["next"]
 
         try:
-            response = await fetch_data(url, params, headers)
+            async with aclosing(paginate_token(_fetch_page)) as items:
+                async for item in items:
+                    yield Playlist(**{
+                        "id": item["id"],
+                        "name": item["snippet"]["title"],
+                        "description": item["snippet"]["description"],
+                        "image": item["snippet"]["thumbnails"].get("high", {}).get("url", "")
+                    })
         except aiohttp.ClientResponseError as e:
             logging.error(f"Error in YouTubeService.get_playlists: {e.status} {e.message}")
             raise
         except Exception as e:
             logging.error(f"Unexpected error in YouTubeService.get_playlists: {e}")
-            raise            
-        
-        playlists = [Playlist(**{
-            "id": item["id"],
-            "name": item["snippet"]["title"],
-            "description": item["snippet"]["description"],
-            "image": item["snippet"]["thumbnails"].get("high", {}).get("url", "")
-        }) for item in response["items"]]
-        
-        return { "playlists": playlists }
+            raise
   
     # Get a playlist's tracks
-    @staticmethod
-    async def get_playlist_tracks(playlist_id: str):
-        # YouTube API client
-        credentials = Credentials.from_authorized_user_info(session["youtube_credentials"])
-        access_token = credentials.token
+    # Concurrent listings of the same playlist for the same user share one upstream call
+    async def get_playlist_tracks(self, playlist_id: str):
+        key = f"youtube_playlist_tracks:{self.user}:{playlist_id}"
+        return await singleflight.do(key, lambda: self._get_playlist_tracks(playlist_id))
+
+    async def _get_playlist_tracks(self, playlist_id: str):
+        return [track async for track in self.iter_playlist_tracks(playlist_id)]
 
-        # Get playlist's items
+    # Iterate over a playlist's music tracks, fetching the next page while the current one is consumed
+    async def iter_playlist_tracks(self, playlist_id: str):
+        async def _fetch_page(page_token: str | None):
+            return await self._fetch_tracks_page(playlist_id, page_token, PAGE_SIZE)
+
+        try:
+            async with aclosing(paginate_token(_fetch_page)) as tracks:
+                async for track in tracks:
+                    yield track
+        except aiohttp.ClientResponseError as e:
+            logging.error(f"Error in YouTubeService.get_playlist_tracks: {e.status} {e.message}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error in YouTubeService.get_playlist_tracks: {e}")
+            raise
+
+    # Get one page of a playlist's music tracks (one playlistItems.list call)
+    # Non-music videos are filtered out, so a page can hold fewer than limit tracks
+    # Returns (tracks, page token of the next page or None on the last page)
+    async def get_playlist_tracks_page(self, playlist_id: str, page_token: str | None = None, limit: int = PAGE_SIZE):
+        try:
+            return await self._fetch_tracks_page(playlist_id, page_token, limit)
+        except aiohttp.ClientResponseError as e:
+            logging.error(f"Error in YouTubeService.get_playlist_tracks_page: {e.status} {e.message}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error in YouTubeService.get_playlist_tracks_page: {e}")
+            raise
+
+    # Get a page of the playlist's items and keep only music videos (categoryId of "10")
+    # Pages are cached with their ETag and revalidated with conditional requests, so an
+    # unchanged page costs one playlistItems.list call and no videos.list calls
+    async def _fetch_tracks_page(self, playlist_id: str, page_token: str | None, limit: int):
         items_url = f"{API_BASE_URL}/playlistItems" # quota cost per call: 1
         items_params = {
             "part": "snippet",
             "playlistId": playlist_id,
-            "maxResults": 50,
-        }
-        items_headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Accept": "application/json",
+            "maxResults": limit,
         }
+        if page_token:
+            items_params["pageToken"] = page_token
 
-        try:
-            items_response = await fetch_data(items_url, items_params, items_headers)
+        async def _fetch(etag: str | None):
+            items_response = await fetch_data(self.http, items_url, items_params, self.headers, etag=etag)
+            if items_response is None:
+                return None
 
             tracks = [Track(**{
                 "id": item["snippet"]["resourceId"]["videoId"],
@@ -134,46 +333,45 @@ class YouTubeService:
                 "image": item["snippet"]["thumbnails"].get("high", {}).get("url", "")
             }) for item in items_response["items"]]
 
-            # Get videos (mainly for their categoryId)
-            videos_url = f"{API_BASE_URL}/videos" # quota cost per call: 1
+            videos = await self._get_videos(list(dict.fromkeys(track.id for track in tracks)))
+
+            music_tracks = [dataclasses.asdict(track) for track in tracks if (videos.get(track.id) or {}).get("categoryId") == "10"]
+            return items_response["etag"], { "tracks": music_tracks, "next": items_response.get("nextPageToken") }
+
+        page = await library_cache.revalidate("youtube", await self.account_id(), f"tracks:{playlist_id}:{page_token or ''}:{limit}", _fetch)
+        return [Track(**track) for track in page["tracks"]], page["next"]
+
+    # Get videos' metadata (mainly their categoryId) from the shared cache,
+    # fetching only the misses from videos.list
+    async def _get_videos(self, video_ids: list[str]):
+        videos_url = f"{API_BASE_URL}/videos" # quota cost per call: 1
+        videos = await video_cache.get_many(video_ids)
+
+        async def _fetch_videos(chunk: list[str]):
             videos_params = {
                 "part": "snippet",
-                "id": [track.id for track in tracks]
-            }
-            videos_headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Accept": "application/json",
+                "id": ",".join(chunk)
             }
+            videos_response = await fetch_data(self.http, videos_url, videos_params, self.headers)
+            return videos_response["items"]
 
-            videos_response = await fetch_data(videos_url, videos_params, videos_headers)
-        except aiohttp.ClientResponseError as e:
-            logging.error(f"Error in YouTubeService.get_playlist_tracks: {e.status} {e.message}")
-            raise
-        except Exception as e:
-            logging.error(f"Unexpected error in YouTubeService.get_playlist_tracks: {e}")
-            raise
+        missed_video_ids = [video_id for video_id in video_ids if video_id not in videos]
+        videos_chunks = await map_chunks(_fetch_videos, missed_video_ids, VIDEOS_BATCH_SIZE)
 
-        # Only return music videos (categoryId of "10")
-        category_ids = [video["snippet"]["categoryId"] for video in videos_response["items"]]
-        filtered_tracks = [track for track, category_id in zip(tracks, category_ids) if category_id == "10"]
+        # Deleted and private videos are missing from the response, so match by id
+        new_videos = dict.fromkeys(missed_video_ids)
+        new_videos.update({video["id"]: video_cache.to_metadata(video) for chunk in videos_chunks for video in chunk})
+        await video_cache.set_many(new_videos)
 
-        return filtered_tracks
+        videos.update(new_videos)
+        return videos
     
     # Create a playlist and return its id
-    @staticmethod
-    async def create_playlist(name: str, description: str):
-        # YouTube API client
-        credentials = Credentials.from_authorized_user_info(session["youtube_credentials"])
-        access_token = credentials.token
-
+    async def create_playlist(self, name: str, description: str):
         url = f"{API_BASE_URL}/playlists" # quota cost per call: 50
         params = {
             "part": "snippet"
         }
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
         json = {
             "snippet": {
                 "title": name,
@@ -182,7 +380,7 @@ class YouTubeService:
         }
         
         try:
-            response = await post(url, params, headers, json)
+            response = await post(self.http, url, params, self.json_headers, json)
         except aiohttp.ClientResponseError as e:
             logging.error(f"Error in YouTubeService.create_playlist: {e.status} {e.message}")
             raise
@@ -192,97 +390,75 @@ class YouTubeService:
 
         return response["id"]
   
-    # Search for tracks and return a list of each video's videoId
+    # Search for tracks and return a list of each video's videoId (None if not found)
     # videoId is used for inserting playlistItems into playlists in fill_playlist()
-    @staticmethod
-    async def search_tracks(tracks: list[str]):
-        async def _search_track(track: str):
-            # Check cache
-            cached_video_id = await fetch_cache(f"youtube_search:{track}")
-            if cached_video_id:
-                return cached_video_id.decode("utf-8")
+    # tracks are in the request body format of /playlists/youtube/create ("name", optional "id" and "isrc")
+    # and source is the provider their ids belong to, used to skip searching tracks converted before
+    async def search_tracks(self, tracks: list[dict], source: str | None = None):
+        video_ids = [None] * len(tracks)
+        async with aclosing(self.search_tracks_as_completed(tracks, source)) as results:
+            async for position, video_id in results:
+                video_ids[position] = video_id
 
-            # YouTube API client
-            credentials = Credentials.from_authorized_user_info(session["youtube_credentials"])
-            access_token = credentials.token
+        return video_ids
 
-            url = f"{API_BASE_URL}/search" # quota cost per call: 100
+    # Search for tracks and yield (position, videoId) as soon as each one resolves
+    # videoId is None for tracks YouTube has no results for
+    # Mapped and cached tracks come first, then upstream searches in completion order
+    async def search_tracks_as_completed(self, tracks: list[dict], source: str | None = None):
+        url = f"{API_BASE_URL}/search" # quota cost per call: 100
+
+        async def _search_track(track: str):
             params = {
                 "part": "snippet",
                 "type": "video",
                 "maxResults": 1,
                 "videoCategoryId": "10", # music
-                "q": ""
+                "q": track
             }
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
-
-            # Fetch from YouTube        
-            params["q"] = track
-            result = await fetch_data(url, headers=headers, params=params)
+            result = await fetch_data(self.http, url, headers=self.headers, params=params, cost=quota.SEARCH_COST)
 
-            video_id = result["items"][0]["id"]["videoId"]
-
-            # Save to cache
-            await set_cache(f"youtube_search:{track}", video_id, ttl=60*60*24) # 1 day
-
-            return video_id
+            if not result["items"]:
+                return None
+            return result["items"][0]["id"]["videoId"]
 
         try:
-            tasks = [_search_track(track) for track in tracks]
-            results = await asyncio.gather(*tasks)
+            async with aclosing(track_map.resolve_as_completed(source, "youtube", tracks, _search_track)) as results:
+                async for position, video_id in results:
+                    yield position, video_id
         except aiohttp.ClientResponseError as e:
             logging.error(f"Error in YouTubeService.search_tracks: {e.status} {e.message}")
             raise
         except Exception as e:
             logging.error(f"Unexpected error in YouTubeService.search_tracks: {e}")
             raise
-
-        return results
   
     # Add tracks to playlist
-    @staticmethod
-    async def fill_playlist(playlist_id: str, video_ids: list[str]):
-        # YouTube API client
-        credentials = Credentials.from_authorized_user_info(session["youtube_credentials"])
-        access_token = credentials.token
-
+    async def fill_playlist(self, playlist_id: str, video_ids: list[str]):
         url = f"{API_BASE_URL}/playlistItems" # quota cost per call: 50
         params = {
             "part": "snippet"
         }
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
 
         async def _add_to_playlist(playlist_id, video_id):
-            MAX_RETRIES = 5
-            retry_count = 0
-            wait_time = 1 # seconds
-
-            while retry_count < MAX_RETRIES:
-                try:
-                    json = {
-                        "snippet": {
-                            "playlistId": playlist_id,
-                            "resourceId": {
-                                "kind": "youtube#video",
-                                "videoId": video_id
-                            }
-                        }
+            json = {
+                "snippet": {
+                    "playlistId": playlist_id,
+                    "resourceId": {
+                        "kind": "youtube#video",
+                        "videoId": video_id
                     }
-                    return await post(url, params, headers, json)
-                except aiohttp.ClientResponseError as e:
-                    if e.status == 409:
-                        retry_count += 1
-                        time.sleep(wait_time)
-                        wait_time *= 2
-                    else:
-                        raise
-            return { "error": "Failed to add video to playlist" }
+                }
+            }
+
+            # 409s (concurrent playlist modification) are retried with backoff by post()
+            # Errors caused by the video itself only fail that video, not the whole fill
+            try:
+                return await post(self.http, url, params, self.json_headers, json)
+            except aiohttp.ClientResponseError as e:
+                if e.status in (400, 404, 409):
+                    return { "error": "Failed to add video to playlist", "status": e.status }
+                raise
 
         try:
             results = [await _add_to_playlist(playlist_id, video_id) for video_id in video_ids]
@@ -293,4 +469,24 @@ class YouTubeService:
             logging.error(f"Unexpected error in YouTubeService.fill_playlist: {e}")
             raise
 
-        return results
\ No newline at end of file
+        return results
+
+    # Remove items from a playlist by playlistItem id
+    async def remove_tracks(self, playlist_id: str, item_ids: list[str]):
+        url = f"{API_BASE_URL}/playlistItems" # quota cost per call: 50
+
+        try:
+            # One at a time like inserts, since concurrent modifications of a playlist conflict
+            for item_id in item_ids:
+                await delete(self.http, url, { "id": item_id }, self.headers)
+        except aiohttp.ClientResponseError as e:
+            logging.error(f"Error in YouTubeService.remove_tracks: {e.status} {e.message}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error in YouTubeService.remove_tracks: {e}")
+            raise
+
+    # playlistItem id of each video fill_playlist() was given (None if it failed to be added)
+    @staticmethod
+    def item_ids(video_ids: list[str], fill_result: list[dict]) -> list[str | None]:
+        return [result.get("id") for result in fill_result]
@@ -1,2 +1,23 @@
 from .redis_utils import fetch_cache
 from .redis_utils import set_cache
+from .redis_utils import fetch_cache_many
+from .redis_utils import set_cache_many
+from .redis_utils import get_redis
+from .redis_utils import get_sync_redis
+from .redis_utils import close_redis
+from .http_client import get_session
+from .http_client import close_session
+from . import jobs
+from . import quota
+from . import rate_limiter
+from . import search_cache
+from . import track_map
+from . import locks
+from . import singleflight
+from . import video_cache
+from . import streaming
+from . import library_cache
+from . import playlist_map
+from . import checkpoints
+from . import event_loop
+from . import metrics
@@ -0,0 +1,24 @@
+import asyncio
+
+# Split bulk upstream operations into provider-sized chunks
+
+def chunked(items: list, size: int) -> list[list]:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+# Call fn(chunk) for every chunk of at most `size` items and return the results in chunk order
+# ordered=True sends one chunk at a time, for operations whose effect depends on the
+# order of the calls (e.g. appending tracks to a playlist). Otherwise up to
+# `concurrency` chunks are in flight at once
+async def map_chunks(fn, items: list, size: int, ordered: bool = False, concurrency: int = 4) -> list:
+    chunks = chunked(items, size)
+
+    if ordered:
+        return [await fn(chunk) for chunk in chunks]
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(chunk):
+        async with semaphore:
+            return await fn(chunk)
+
+    return await asyncio.gather(*[_run(chunk) for chunk in chunks])
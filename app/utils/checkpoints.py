@@ -0,0 +1,142 @@
+from app.config import config
+from app.utils.redis_utils import get_redis
+from app.utils import locks
+from contextlib import asynccontextmanager
+import hashlib
+import json
+
+# Checkpoints of playlist conversions, so a repeated request resumes where it stopped
+# instead of paying again for work already done
+# checkpoint:{request key}:{index} is a hash per playlist of the request with fields
+#   playlist_id         the created target playlist
+#   resolved:{position} the track's target id ("" if the target has no result for it)
+#   inserted:{position} the item id of the track once it is in the target playlist
+#   filled:{position}   JSON fill results of the insert batch starting at that position
+#   result              the playlist's JSON result once it completed
+# checkpoint:{request key}:body holds a fingerprint of the request body the key was first
+# used with, and checkpoint:{request key}:lock is held while a conversion with the key runs
+
+settings = config["default"]
+
+LOCK_TTL = 30 # seconds, renewed while the conversion runs
+
+# Another conversion with the same request key is running
+class RequestInProgress(Exception):
+    def __init__(self):
+        super().__init__("A request with this Idempotency-Key is already in progress")
+
+# The request key was used before with another request body
+class RequestMismatch(Exception):
+    def __init__(self):
+        super().__init__("This Idempotency-Key was already used with a different request body")
+
+def _key(request_key: str, index: int) -> str:
+    return f"checkpoint:{request_key}:{index}"
+
+def _lock_key(request_key: str) -> str:
+    return f"checkpoint:{request_key}:lock"
+
+def _fingerprint(playlists: list[dict]) -> str:
+    return hashlib.sha256(json.dumps(playlists, sort_keys=True).encode("utf-8")).hexdigest()
+
+# Remember the request body a key is used with, or check it is the one remembered
+# Raises RequestMismatch otherwise, as the checkpoints' positions belong to that body
+async def check_body(request_key: str | None, playlists: list[dict]):
+    if request_key is None:
+        return
+
+    key = f"checkpoint:{request_key}:body"
+    fingerprint = _fingerprint(playlists)
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.set(key, fingerprint, nx=True, ex=settings.CHECKPOINT_TTL)
+        pipe.get(key)
+        pipe.expire(key, settings.CHECKPOINT_TTL)
+        _, stored, _ = await pipe.execute()
+
+    if stored.decode("utf-8") != fingerprint:
+        raise RequestMismatch()
+
+# Whether a conversion with the request key is running
+async def in_progress(request_key: str | None) -> bool:
+    return request_key is not None and bool(await get_redis().exists(_lock_key(request_key)))
+
+# Run a conversion as the only one with its request key, for the request body playlists
+# Raises RequestMismatch (see check_body) or RequestInProgress if one is already running
+@asynccontextmanager
+async def claim(request_key: str | None, playlists: list[dict]):
+    if request_key is None:
+        yield
+        return
+
+    await check_body(request_key, playlists)
+    async with locks.hold(_lock_key(request_key), LOCK_TTL) as held:
+        if not held:
+            raise RequestInProgress()
+        yield
+
+class Checkpoint:
+    # request_key None keeps the checkpoint in memory only (nothing to resume from)
+    def __init__(self, request_key: str | None, index: int, fields: dict[str, str]):
+        self.key = _key(request_key, index) if request_key else None
+        self.playlist_id = fields.get("playlist_id")
+        self.resolved = {int(field.removeprefix("resolved:")): value or None
+                         for field, value in fields.items() if field.startswith("resolved:")}
+        self.inserted = {int(field.removeprefix("inserted:")): value
+                         for field, value in fields.items() if field.startswith("inserted:")}
+        self.filled = {int(field.removeprefix("filled:")): json.loads(value)
+                       for field, value in fields.items() if field.startswith("filled:")}
+        self.result = json.loads(fields["result"]) if "result" in fields else None
+
+    async def _save(self, mapping: dict[str, str]):
+        if self.key is None or not mapping:
+            return
+
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.hset(self.key, mapping=mapping)
+            pipe.expire(self.key, settings.CHECKPOINT_TTL)
+            await pipe.execute()
+
+    async def save_playlist_id(self, playlist_id: str):
+        self.playlist_id = playlist_id
+        await self._save({ "playlist_id": playlist_id })
+
+    # resolved is {position: target id or None}
+    async def save_resolved(self, resolved: dict[int, str | None]):
+        self.resolved.update(resolved)
+        await self._save({f"resolved:{position}": track_id or "" for position, track_id in resolved.items()})
+
+    # inserted is {position: item id} of one batch starting at position, and fill_results
+    # the batch's fill results. A batch retried from the same position replaces them
+    async def save_inserted(self, position: int, inserted: dict[int, str], fill_results: list):
+        self.inserted.update(inserted)
+        self.filled[position] = fill_results
+        mapping = {f"inserted:{track_position}": item_id for track_position, item_id in inserted.items()}
+        mapping[f"filled:{position}"] = json.dumps(fill_results)
+        await self._save(mapping)
+
+    # Fill results of every batch inserted so far, across attempts, in playlist order
+    def fill_results(self) -> list:
+        return [fill_result for position in sorted(self.filled) for fill_result in self.filled[position]]
+
+    async def complete(self, result):
+        self.result = result
+        await self._save({ "result": json.dumps(result) })
+
+async def load(request_key: str | None, index: int) -> Checkpoint:
+    if request_key is None:
+        return Checkpoint(None, index, {})
+
+    fields = await get_redis().hgetall(_key(request_key, index))
+    return Checkpoint(request_key, index, {field.decode("utf-8"): value.decode("utf-8") for field, value in fields.items()})
+
+async def load_many(request_key: str | None, count: int) -> list[Checkpoint]:
+    if request_key is None:
+        return [Checkpoint(None, index, {}) for index in range(count)]
+
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for index in range(count):
+            pipe.hgetall(_key(request_key, index))
+        results = await pipe.execute()
+
+    return [Checkpoint(request_key, index, {field.decode("utf-8"): value.decode("utf-8") for field, value in fields.items()})
+            for index, fields in enumerate(results)]
@@ -0,0 +1,139 @@
+from app.utils import metrics
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+import aiohttp
+import asyncio
+import collections
+import datetime
+import threading
+import time
+import weakref
+
+# Parse a Retry-After header (delay in seconds or an HTTP date) into seconds
+def parse_retry_after(headers) -> float | None:
+    value = (headers or {}).get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+# Whether a response status means the upstream is overloaded or rate limiting us
+def is_overload_status(status: int) -> bool:
+    return status == 429 or status >= 500
+
+class _LoopState:
+    __slots__ = ("in_flight", "waiters")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.waiters: collections.deque[asyncio.Future] = collections.deque()
+
+# AIMD concurrency limit for one upstream provider
+# The limit grows by about one slot per window of successful calls and is cut by
+# decrease_factor when the provider answers 429 or 5xx. A Retry-After header pauses
+# every new call until it has passed. The learned limit is shared by the whole
+# process; in-flight counts and waiters are kept per event loop because asyncio
+# futures cannot be awaited across loops
+class AdaptiveLimiter:
+    def __init__(self, name: str, initial: int, minimum: int, maximum: int,
+                 decrease_factor: float = 0.5, decrease_cooldown: float = 1.0):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown # seconds between two decreases
+
+        self._limit = float(min(max(initial, minimum), maximum))
+        self._limit_gauge = metrics.UPSTREAM_CONCURRENCY_LIMIT.labels(name)
+        self._limit_gauge.set(self._limit)
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._states: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState] = weakref.WeakKeyDictionary()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    # Wrap one upstream call. Feeds the call's outcome back into the limit
+    @asynccontextmanager
+    async def slot(self):
+        state = await self._acquire()
+        try:
+            yield
+        except aiohttp.ClientResponseError as e:
+            if is_overload_status(e.status):
+                self.on_overload(parse_retry_after(e.headers))
+            raise
+        else:
+            self.on_success()
+        finally:
+            self._release(state)
+
+    def on_success(self):
+        with self._lock:
+            self._limit = min(self.maximum, self._limit + 1 / self._limit)
+            self._limit_gauge.set(self._limit)
+
+    def on_overload(self, retry_after: float | None = None):
+        now = time.monotonic()
+        with self._lock:
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+            # A burst of failures from one congested window only counts once
+            if now - self._last_decrease >= self.decrease_cooldown:
+                self._limit = max(self.minimum, self._limit * self.decrease_factor)
+                self._last_decrease = now
+                self._limit_gauge.set(self._limit)
+
+    async def _acquire(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState()
+
+        while True:
+            # Honor Retry-After before taking a slot
+            delay = self._blocked_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            if state.in_flight < self.limit:
+                state.in_flight += 1
+                return state
+
+            waiter = loop.create_future()
+            state.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass on a wake-up this waiter can no longer use
+                if waiter.done() and not waiter.cancelled():
+                    self._wake(state)
+                raise
+            finally:
+                if waiter in state.waiters:
+                    state.waiters.remove(waiter)
+
+    def _release(self, state: _LoopState):
+        state.in_flight -= 1
+        self._wake(state)
+
+    def _wake(self, state: _LoopState):
+        free_slots = self.limit - state.in_flight
+        while free_slots > 0 and state.waiters:
+            waiter = state.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free_slots -= 1
@@ -0,0 +1,40 @@
+import asyncio
+import concurrent.futures
+import contextvars
+
+# The long-lived event loop of a worker process served over ASGI (see asgi.py)
+# Views run in threads of the server's pool, and their coroutines are handed to this
+# loop, so pooled connections, caches and in-flight calls are shared across requests.
+# None under the dev server, where Flask runs every async view in its own loop
+
+_loop: asyncio.AbstractEventLoop | None = None
+
+def get_loop() -> asyncio.AbstractEventLoop | None:
+    return _loop
+
+def set_loop(loop: asyncio.AbstractEventLoop | None):
+    global _loop
+    _loop = loop
+
+# Run a coroutine on the app loop from another thread and wait for its result
+# The coroutine runs in a copy of the calling thread's context, so it still sees the
+# Flask request context and any context variables set by the caller
+def run(coro):
+    context = contextvars.copy_context()
+    future = concurrent.futures.Future()
+
+    def _copy_result(task: asyncio.Task):
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def _start():
+        # Tasks copy the context they are created in, which is the caller's here
+        task = _loop.create_task(coro)
+        task.add_done_callback(_copy_result)
+
+    _loop.call_soon_threadsafe(_start, context=context)
+    return future.result()
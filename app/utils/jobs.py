@@ -0,0 +1,168 @@
+from app.utils.redis_utils import get_redis
+import asyncio
+import datetime
+import json
+import uuid
+
+# Redis-backed queue of playlist conversion jobs
+# Jobs are hashes at job:{id}. Their ids are pushed onto JOB_QUEUE_KEY and moved by
+# worker.py onto its own processing list, where they stay until the job finishes. Workers
+# keep a heartbeat key alive; the processing list of a worker whose heartbeat expired
+# (it crashed) is moved back onto the queue. The payload (request body and credentials)
+# is deleted once a job finishes
+
+JOB_QUEUE_KEY = "jobs:queue"
+JOB_TTL = 60 * 60 * 24 # 1 day
+WORKERS_KEY = "jobs:workers"
+WORKER_HEARTBEAT_TTL = 30 # seconds
+
+def _job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+def _processing_key(worker_id: str) -> str:
+    return f"jobs:processing:{worker_id}"
+
+def _heartbeat_key(worker_id: str) -> str:
+    return f"jobs:worker:{worker_id}"
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+# Queue a job and return its id
+# progress starts with one entry per playlist so status can be shown before the job runs
+# sync=True syncs playlists converted before instead of creating them again
+# request_key is the key the conversion is checkpointed under, so it can be resumed
+# Without one the job gets its own, so a job interrupted by a worker crash still resumes
+async def enqueue_job(kind: str, user: str, playlists: list[dict], credentials: dict, sync: bool = False,
+                      request_key: str | None = None) -> str:
+    job_id = uuid.uuid4().hex
+    if request_key is None:
+        request_key = f"{kind}:job:{job_id}"
+    progress = [{
+        "name": playlist["name"],
+        "status": "pending",
+        "playlist_id": None,
+        "tracks_total": len(playlist["tracks"]),
+        "tracks_added": 0
+    } for playlist in playlists]
+    payload = { "playlists": playlists, "credentials": credentials, "request_key": request_key }
+
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.hset(_job_key(job_id), mapping={
+            "id": job_id,
+            "kind": kind,
+            "mode": "sync" if sync else "create",
+            "user": user,
+            "status": "queued",
+            "created_at": _now(),
+            "progress": json.dumps(progress),
+            "payload": json.dumps(payload)
+        })
+        pipe.expire(_job_key(job_id), JOB_TTL)
+        pipe.lpush(JOB_QUEUE_KEY, job_id)
+        await pipe.execute()
+
+    return job_id
+
+# Get a job's public fields, or None if it does not exist or was queued by another user
+# The payload and the user (a session id) are never returned
+async def get_job(job_id: str, user: str) -> dict | None:
+    job = await get_redis().hgetall(_job_key(job_id))
+    if not job:
+        return None
+
+    job = {key.decode("utf-8"): value.decode("utf-8") for key, value in job.items()}
+    if job.pop("user", None) != user:
+        return None
+    job.pop("payload", None)
+    job["progress"] = json.loads(job["progress"])
+    if "result" in job:
+        job["result"] = json.loads(job["result"])
+    return job
+
+# Block until a job is available, move it onto the worker's processing list and return
+# (job_id, job fields including payload). Finish it with finish_job to take it off the list
+# Returns None on timeout or if the job expired or finished while queued
+async def dequeue_job(worker_id: str, timeout: int = 5) -> tuple[str, dict] | None:
+    moved = await get_redis().blmove(JOB_QUEUE_KEY, _processing_key(worker_id), timeout, "RIGHT", "LEFT")
+    if moved is None:
+        return None
+
+    job_id = moved.decode("utf-8")
+    job = await get_redis().hgetall(_job_key(job_id))
+    # A job requeued after its worker crashed may have finished just before the crash
+    if not job or b"payload" not in job:
+        await get_redis().lrem(_processing_key(worker_id), 0, job_id)
+        return None
+
+    job = {key.decode("utf-8"): value.decode("utf-8") for key, value in job.items()}
+    job["progress"] = json.loads(job["progress"])
+    job["payload"] = json.loads(job["payload"])
+    return job_id, job
+
+async def update_job(job_id: str, **fields):
+    mapping = {key: json.dumps(value) if key in ("progress", "result") else value for key, value in fields.items()}
+    mapping["updated_at"] = _now()
+    await get_redis().hset(_job_key(job_id), mapping=mapping)
+
+# Mark a job finished, drop its payload and take it off the worker's processing list
+async def finish_job(worker_id: str, job_id: str, status: str, **fields):
+    mapping = {key: json.dumps(value) if key in ("progress", "result") else value for key, value in fields.items()}
+    mapping.update(status=status, updated_at=_now())
+
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.hset(_job_key(job_id), mapping=mapping)
+        pipe.hdel(_job_key(job_id), "payload")
+        pipe.lrem(_processing_key(worker_id), 0, job_id)
+        await pipe.execute()
+
+# Register a worker, or keep it registered. Call at least every WORKER_HEARTBEAT_TTL seconds
+async def heartbeat(worker_id: str):
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.sadd(WORKERS_KEY, worker_id)
+        pipe.set(_heartbeat_key(worker_id), _now(), ex=WORKER_HEARTBEAT_TTL)
+        await pipe.execute()
+
+# Move the jobs of workers whose heartbeat expired back onto the queue, ahead of new jobs
+# Their conversions resume from the checkpoint under the job's request_key
+# Returns the number of jobs requeued
+async def requeue_stale_jobs() -> int:
+    requeued = 0
+    for worker_id in await get_redis().smembers(WORKERS_KEY):
+        worker_id = worker_id.decode("utf-8")
+        if await get_redis().exists(_heartbeat_key(worker_id)):
+            continue
+
+        requeued += await _requeue(worker_id)
+        await get_redis().srem(WORKERS_KEY, worker_id)
+    return requeued
+
+# Unregister a worker that is stopping, requeueing any job it did not finish
+async def unregister_worker(worker_id: str):
+    await _requeue(worker_id)
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.delete(_heartbeat_key(worker_id))
+        pipe.srem(WORKERS_KEY, worker_id)
+        await pipe.execute()
+
+# Moves the newest job first so the oldest ends up next in line
+async def _requeue(worker_id: str) -> int:
+    requeued = 0
+    while await get_redis().lmove(_processing_key(worker_id), JOB_QUEUE_KEY, "LEFT", "RIGHT") is not None:
+        requeued += 1
+    return requeued
+
+# Per-playlist progress of a running job, written through to Redis on every update
+# Use update as the on_progress callback of ConversionService
+class JobProgress:
+    def __init__(self, job_id: str, progress: list[dict]):
+        self.job_id = job_id
+        self.progress = progress
+        self._lock = asyncio.Lock()
+
+    async def update(self, index: int, **fields):
+        self.progress[index].update(fields)
+
+        # Serialize writes so an older snapshot never overwrites a newer one
+        async with self._lock:
+            await update_job(self.job_id, progress=self.progress)
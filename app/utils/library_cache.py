@@ -0,0 +1,43 @@
+from app.config import config
+from app.utils.redis_utils import get_redis
+import json
+
+# Per-account cache of library listings, stored with the upstream version they were fetched at
+# (a Spotify snapshot_id or a YouTube ETag). Keys are library:{provider}:{account}:{name},
+# where account is the provider account id (see ProviderClient.account_id), so a library
+# is reused across logins. Entries are only reused after revalidating them against
+# upstream, so the ttl just bounds how long an unused library is kept
+
+settings = config["default"]
+
+def _key(provider: str, account: str, name: str) -> str:
+    return f"library:{provider}:{account}:{name}"
+
+# Returns (version, value), or None if nothing is cached
+async def load(provider: str, account: str, name: str):
+    cached = await get_redis().get(_key(provider, account, name))
+    if cached is None:
+        return None
+
+    entry = json.loads(cached)
+    return entry["version"], entry["value"]
+
+# value must be JSON-serializable
+async def save(provider: str, account: str, name: str, version: str, value):
+    entry = json.dumps({ "version": version, "value": value })
+    await get_redis().setex(_key(provider, account, name), settings.LIBRARY_CACHE_TTL, entry)
+
+# Get a value through the cache, refetching it only if it changed upstream
+# fetch(cached_version) returns None if cached_version is still current (e.g. a 304),
+# and (version, value) otherwise
+async def revalidate(provider: str, account: str, name: str, fetch):
+    cached = await load(provider, account, name)
+    result = await fetch(cached[0] if cached else None)
+
+    if result is None and cached is not None:
+        return cached[1]
+
+    version, value = result
+    if version is not None:
+        await save(provider, account, name, version, value)
+    return value
@@ -0,0 +1,53 @@
+from app.utils.redis_utils import get_redis
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import uuid
+
+# Redis locks held by one caller at a time across workers
+# A lock is a key holding its owner's token with a ttl, so the lock of an owner that
+# crashed expires on its own. A live owner renews the ttl in the background for as long
+# as it holds the lock, however long that is
+
+# Delete the lock only if it is still ours
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Extend the lock's ttl (ARGV[2], seconds) only if it is still ours
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Try to take the lock at key, yielding whether it was taken
+# Taken locks are renewed every ttl / 3 seconds and released on exit
+@asynccontextmanager
+async def hold(key: str, ttl: int):
+    token = uuid.uuid4().hex
+    if not await get_redis().set(key, token, nx=True, ex=ttl):
+        yield False
+        return
+
+    renew_task = asyncio.create_task(_renew(key, token, ttl))
+    try:
+        yield True
+    finally:
+        renew_task.cancel()
+        await get_redis().register_script(RELEASE_SCRIPT)(keys=[key], args=[token])
+
+async def _renew(key: str, token: str, ttl: int):
+    renew = get_redis().register_script(RENEW_SCRIPT)
+    while True:
+        await asyncio.sleep(ttl / 3)
+        try:
+            if not await renew(keys=[key], args=[token, ttl]):
+                logging.error(f"Lock {key} expired before it was released")
+                return
+        except Exception as e:
+            logging.error(f"Error in locks._renew: {e}")
@@ -0,0 +1,102 @@
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client import CONTENT_TYPE_LATEST
+from contextlib import contextmanager
+import aiohttp
+import os
+import time
+
+# Prometheus metrics of the app, served in text format on /metrics
+# Upstream calls are labeled by provider, HTTP method and endpoint (the API path with ids
+# replaced, so labels stay few). With several worker processes (asgi.py), point
+# PROMETHEUS_MULTIPROC_DIR at an empty directory shared by them so /metrics sums up
+# every process instead of the one that happens to answer the scrape
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # seconds
+
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "youtify_upstream_request_seconds",
+    "Latency of upstream API calls (each retry attempt is one call)",
+    ["provider", "method", "endpoint"],
+    buckets=LATENCY_BUCKETS
+)
+UPSTREAM_RESPONSES = Counter(
+    "youtify_upstream_responses_total",
+    "Upstream API calls by response status (\"error\" when no response came back)",
+    ["provider", "method", "endpoint", "status"]
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "youtify_upstream_in_flight_requests",
+    "Upstream API calls waiting for a response",
+    ["provider"],
+    multiprocess_mode="livesum"
+)
+UPSTREAM_CONCURRENCY_LIMIT = Gauge(
+    "youtify_upstream_concurrency_limit",
+    "Concurrency limit learned by each provider's AdaptiveLimiter",
+    ["provider"],
+    multiprocess_mode="liveall"
+)
+YOUTUBE_QUOTA_UNITS = Counter(
+    "youtify_youtube_quota_units_total",
+    "YouTube Data API quota units spent"
+)
+CACHE_REQUESTS = Counter(
+    "youtify_cache_requests_total",
+    "Cache lookups by tier (local or redis), key namespace and result (hit or miss)",
+    ["tier", "namespace", "result"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "youtify_http_request_seconds",
+    "Latency of requests served by the app, by Flask endpoint",
+    ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "youtify_http_requests_in_flight",
+    "Requests the app is serving",
+    multiprocess_mode="livesum"
+)
+
+class UpstreamCall:
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = None
+
+# Time one upstream call and count its status
+# Set call.status to the response's status once it is in. Errors raised for a status
+# (raise_for_status) are counted with it, others (timeouts, connection errors) as "error"
+@contextmanager
+def upstream_call(provider: str, method: str, endpoint: str):
+    call = UpstreamCall()
+    in_flight = UPSTREAM_IN_FLIGHT.labels(provider)
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield call
+    except aiohttp.ClientResponseError as e:
+        call.status = call.status or e.status
+        raise
+    finally:
+        in_flight.dec()
+        UPSTREAM_REQUEST_SECONDS.labels(provider, method, endpoint).observe(time.perf_counter() - start)
+        UPSTREAM_RESPONSES.labels(provider, method, endpoint, str(call.status or "error")).inc()
+
+def is_multiprocess() -> bool:
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# Metrics in Prometheus text format
+def generate() -> bytes:
+    if not is_multiprocess():
+        return generate_latest(REGISTRY)
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+# Drop the live gauges of a process that is exiting (multiprocess mode only)
+def mark_process_dead():
+    if is_multiprocess():
+        multiprocess.mark_process_dead(os.getpid())
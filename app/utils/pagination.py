@@ -0,0 +1,90 @@
+import asyncio
+import base64
+import binascii
+import collections
+import json
+
+# Async generators over every item of a paginated upstream listing
+
+# Offset-based pagination (Spotify)
+# fetch_page(offset, limit) returns (items, total). After the first page the offsets
+# of all remaining pages are known, so up to `concurrency` pages are fetched at once
+# while items are still yielded in order
+async def paginate_offset(fetch_page, limit: int, concurrency: int = 4):
+    items, total = await fetch_page(0, limit)
+    for item in items:
+        yield item
+
+    offsets = iter(range(limit, total, limit))
+    pending: collections.deque[asyncio.Task] = collections.deque()
+
+    def _prefetch():
+        while len(pending) < concurrency:
+            offset = next(offsets, None)
+            if offset is None:
+                return
+            pending.append(asyncio.create_task(fetch_page(offset, limit)))
+
+    try:
+        _prefetch()
+        while pending:
+            items, _ = await pending.popleft()
+            _prefetch()
+            for item in items:
+                yield item
+    finally:
+        for task in pending:
+            task.cancel()
+
+# Token-based pagination (YouTube)
+# fetch_page(page_token) returns (items, next_page_token). Pages can only be fetched
+# one after another, so the next page is fetched while the current one is consumed,
+# with at most `buffer` pages waiting
+async def paginate_token(fetch_page, buffer: int = 2):
+    pages: asyncio.Queue = asyncio.Queue(maxsize=buffer)
+    done = object()
+
+    async def _produce():
+        page_token = None
+        try:
+            while True:
+                items, page_token = await fetch_page(page_token)
+                await pages.put(items)
+                if not page_token:
+                    break
+        except Exception as e:
+            await pages.put(e)
+            return
+        await pages.put(done)
+
+    producer = asyncio.create_task(_produce())
+    try:
+        while True:
+            page = await pages.get()
+            if page is done:
+                return
+            if isinstance(page, Exception):
+                raise page
+            for item in page:
+                yield item
+    finally:
+        producer.cancel()
+
+# Opaque cursors for paginated endpoints
+# A cursor is the provider's page position (offset or page token) as unpadded URL-safe base64 JSON,
+# so clients page through results without depending on how each provider paginates
+
+def encode_cursor(position: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii").rstrip("=")
+
+# Raises ValueError for cursors that were not made by encode_cursor
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode((cursor + padding).encode("ascii")))
+    except (UnicodeError, binascii.Error, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    if not isinstance(position, dict):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return position
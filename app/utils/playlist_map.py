@@ -0,0 +1,53 @@
+from app.utils.redis_utils import get_redis
+from collections import Counter
+import json
+
+# Mapping of converted playlists per target account, used by sync mode
+# playlist_map:{account}:{source}:{source playlist id}:{target} holds JSON of the target
+# playlist's id and its items as last converted or synced: [track id, item id] pairs in
+# order, where the item id is what removes the track from the playlist (Spotify track
+# uri, YouTube playlistItem id). account is the target account id (see
+# ProviderClient.account_id), which outlives sessions. Entries never expire
+
+def _key(account: str, source: str, source_playlist_id: str, target: str) -> str:
+    return f"playlist_map:{account}:{source}:{source_playlist_id}:{target}"
+
+# Look up mapped playlists in one round trip
+# Returns {source playlist id: {"playlist_id": ..., "items": [[track id, item id], ...]}}
+async def get_many(account: str, source: str, source_playlist_ids: list[str], target: str) -> dict[str, dict]:
+    if not source_playlist_ids:
+        return {}
+
+    values = await get_redis().mget([_key(account, source, playlist_id, target) for playlist_id in source_playlist_ids])
+    return {playlist_id: json.loads(value) for playlist_id, value in zip(source_playlist_ids, values) if value is not None}
+
+async def save(account: str, source: str, source_playlist_id: str, target: str, playlist_id: str, items: list[tuple[str, str]]):
+    entry = { "playlist_id": playlist_id, "items": [list(item) for item in items] }
+    await get_redis().set(_key(account, source, source_playlist_id, target), json.dumps(entry))
+
+async def delete(account: str, source: str, source_playlist_id: str, target: str):
+    await get_redis().delete(_key(account, source, source_playlist_id, target))
+
+# Diff a target playlist's items against the track ids it should hold
+# Returns (item ids to remove, items kept, track ids to append). Removing an item id
+# removes every item sharing it (Spotify removes all copies of a uri), so the tracks to
+# append are counted against what is actually kept
+def diff(items: list[tuple[str, str]], track_ids: list[str]):
+    wanted = Counter(track_ids)
+    removed_item_ids = set()
+    for track_id, item_id in items:
+        if wanted[track_id] > 0:
+            wanted[track_id] -= 1
+        else:
+            removed_item_ids.add(item_id)
+
+    kept = [(track_id, item_id) for track_id, item_id in items if item_id not in removed_item_ids]
+    available = Counter(track_id for track_id, _ in kept)
+    added = []
+    for track_id in track_ids:
+        if available[track_id] > 0:
+            available[track_id] -= 1
+        else:
+            added.append(track_id)
+
+    return list(removed_item_ids), kept, added
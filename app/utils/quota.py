@@ -0,0 +1,103 @@
+from app.config import config
+from app.utils import metrics
+from app.utils.redis_utils import get_redis
+from contextlib import asynccontextmanager
+from zoneinfo import ZoneInfo
+import contextvars
+import datetime
+
+# YouTube Data API quota accounting shared by all workers through Redis
+# Spent units are counted per quota day. Conversions reserve their estimated cost
+# up front; units they then spend are moved from reserved to spent, so a running
+# conversion is never counted twice and admission sees every in-flight commitment
+
+settings = config["default"]
+
+# YouTube quota resets at midnight Pacific Time
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+KEY_TTL = 60 * 60 * 48 # 2 days
+
+# Costs of the endpoints used by YouTubeService
+SEARCH_COST = 100
+INSERT_COST = 50
+DELETE_COST = 50
+LIST_COST = 1
+
+class QuotaExceeded(Exception):
+    def __init__(self, estimate: int, remaining: int):
+        super().__init__(f"Estimated cost of {estimate} units exceeds remaining quota of {remaining} units")
+        self.estimate = estimate
+        self.remaining = remaining
+        self.retry_after = seconds_until_reset()
+
+class _Reservation:
+    def __init__(self, units: int):
+        self.units = units
+
+_current_reservation: contextvars.ContextVar[_Reservation | None] = contextvars.ContextVar("quota_reservation", default=None)
+
+# Reserve units only if spent + reserved + units fits within the daily limit
+# Returns the new reserved total, or -1 with nothing reserved
+RESERVE_SCRIPT = """
+local spent = tonumber(redis.call('GET', KEYS[1]) or '0')
+local reserved = tonumber(redis.call('GET', KEYS[2]) or '0')
+local units = tonumber(ARGV[1])
+if spent + reserved + units > tonumber(ARGV[2]) then
+    return -1
+end
+local total = redis.call('INCRBY', KEYS[2], units)
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return total
+"""
+
+def _quota_day() -> str:
+    return datetime.datetime.now(QUOTA_TIMEZONE).date().isoformat()
+
+def _keys() -> tuple[str, str]:
+    day = _quota_day()
+    return f"youtube_quota:{day}:spent", f"youtube_quota:{day}:reserved"
+
+def seconds_until_reset() -> int:
+    now = datetime.datetime.now(QUOTA_TIMEZONE)
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), QUOTA_TIMEZONE)
+    return int((midnight - now).total_seconds()) + 1
+
+# Units left today after spent and reserved units
+async def remaining() -> int:
+    spent, reserved = await get_redis().mget(_keys())
+    return settings.YOUTUBE_DAILY_QUOTA - int(spent or 0) - int(reserved or 0)
+
+# Record units spent by one upstream call
+async def record(units: int):
+    metrics.YOUTUBE_QUOTA_UNITS.inc(units)
+    spent_key, reserved_key = _keys()
+
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.incrby(spent_key, units)
+        pipe.expire(spent_key, KEY_TTL)
+
+        reservation = _current_reservation.get()
+        if reservation is not None and reservation.units > 0:
+            released = min(units, reservation.units)
+            reservation.units -= released
+            pipe.decrby(reserved_key, released)
+
+        await pipe.execute()
+
+# Hold an estimated cost for the duration of a conversion
+# Raises QuotaExceeded without reserving anything if the estimate does not fit
+@asynccontextmanager
+async def reservation(units: int):
+    _, reserved_key = _keys()
+    total = await get_redis().eval(RESERVE_SCRIPT, 2, *_keys(), units, settings.YOUTUBE_DAILY_QUOTA, KEY_TTL)
+    if total == -1:
+        raise QuotaExceeded(units, await remaining())
+
+    held = _Reservation(units)
+    token = _current_reservation.set(held)
+    try:
+        yield
+    finally:
+        _current_reservation.reset(token)
+        if held.units > 0:
+            await get_redis().decrby(reserved_key, held.units)
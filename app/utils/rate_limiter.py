@@ -0,0 +1,101 @@
+from flask import has_request_context, session
+from app.config import config
+from app.utils.redis_utils import get_redis
+import asyncio
+import contextvars
+
+# Redis-backed token buckets shared by every worker
+# Each provider has one global bucket (refilled at the provider's configured rate)
+# and one bucket per user. Users seen within ACTIVE_WINDOW seconds split the
+# provider rate evenly, so a single large conversion cannot starve small
+# requests from other users. Whoever is alone gets the whole rate
+# Callers take a token while holding their provider's concurrency slot, so only callers
+# that are about to make a request poll the buckets, not every queued one
+
+settings = config["default"]
+
+# KEYS: global bucket, user bucket, active users zset
+# ARGV: rate (tokens/s), burst, user, active window (s)
+# Returns 0 when a token was taken, otherwise milliseconds to wait before trying again
+ACQUIRE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local user = ARGV[3]
+local window = tonumber(ARGV[4])
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+-- Track active users
+redis.call('ZADD', KEYS[3], now, user)
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now - window)
+redis.call('EXPIRE', KEYS[3], window * 2)
+
+local active_users = redis.call('ZCARD', KEYS[3])
+local user_rate = rate / active_users
+local user_burst = math.max(1, burst / active_users)
+
+local function refill(key, key_rate, key_burst)
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or key_burst
+    local ts = tonumber(bucket[2]) or now
+    return math.min(key_burst, tokens + math.max(0, now - ts) * key_rate)
+end
+
+local global_tokens = refill(KEYS[1], rate, burst)
+local user_tokens = refill(KEYS[2], user_rate, user_burst)
+
+local wait = 0
+if global_tokens >= 1 and user_tokens >= 1 then
+    global_tokens = global_tokens - 1
+    user_tokens = user_tokens - 1
+else
+    wait = math.max((1 - global_tokens) / rate, (1 - user_tokens) / user_rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', global_tokens, 'ts', now)
+redis.call('HSET', KEYS[2], 'tokens', user_tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + window)
+redis.call('EXPIRE', KEYS[2], math.ceil(user_burst / user_rate) + window)
+
+if wait == 0 then
+    return 0
+end
+return math.max(1, math.ceil(wait * 1000))
+"""
+
+# Rate (requests/s) and burst size per provider
+LIMITS = {
+    "spotify": (settings.SPOTIFY_RATE_LIMIT, settings.SPOTIFY_RATE_BURST),
+    "youtube": (settings.YOUTUBE_RATE_LIMIT, settings.YOUTUBE_RATE_BURST),
+}
+
+# Identifies the user on whose behalf upstream calls are made
+# Set it where there is no Flask request (e.g. background jobs)
+current_user: contextvars.ContextVar[str | None] = contextvars.ContextVar("rate_limit_user", default=None)
+
+def user_key() -> str:
+    user = current_user.get()
+    if user is not None:
+        return user
+    if has_request_context() and getattr(session, "sid", None):
+        return session.sid
+    return "anonymous"
+
+# Wait until both the provider's and the user's bucket have a token, then take it
+# The script is sent by its sha (EVALSHA) and only loaded when Redis does not have it yet
+async def acquire(provider: str, user: str | None = None):
+    rate, burst = LIMITS[provider]
+    user = user or user_key()
+    keys = [
+        f"ratelimit:{provider}",
+        f"ratelimit:{provider}:user:{user}",
+        f"ratelimit:{provider}:active",
+    ]
+
+    acquire_script = get_redis().register_script(ACQUIRE_SCRIPT)
+    while True:
+        wait_ms = await acquire_script(keys=keys, args=[rate, burst, user, settings.RATE_LIMIT_ACTIVE_WINDOW])
+        if wait_ms == 0:
+            return
+        await asyncio.sleep(wait_ms / 1000)
@@ -1,12 +1,113 @@
+from redis import Redis
+from app.config import config, redis_pool
+from app.utils import metrics
+from app.utils.local_cache import LocalCache
 import redis.asyncio as redis
-import os
+import asyncio
 
-REDIS_URL = os.getenv("REDIS_URL")
+settings = config["default"]
+
+REDIS_URL = settings.REDIS_URL
+
+# In-process tier in front of Redis for hot, rarely changing namespaces
+# A key's namespace is the part before its first ":". Each enabled namespace gets its
+# own LocalCache so one namespace cannot evict another's entries
+local_caches = {
+    namespace: LocalCache(settings.LOCAL_CACHE_MAX_ITEMS, settings.LOCAL_CACHE_MAX_BYTES)
+    for namespace in settings.LOCAL_CACHE_NAMESPACES
+}
+
+def _namespace(key: str) -> str:
+    return key.split(":", 1)[0]
+
+# Hit/miss counts per tier and namespace (see app/utils/metrics.py)
+def _count(tier: str, key: str, outcome: str):
+    metrics.CACHE_REQUESTS.labels(tier, _namespace(key), outcome).inc()
+
+# Values as Redis returns them
+def _to_bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+def _local_cache(key: str) -> LocalCache | None:
+    return local_caches.get(_namespace(key))
+
+def _set_local(key: str, value, ttl=None):
+    local_cache = _local_cache(key)
+    if local_cache is not None:
+        local_ttl = settings.LOCAL_CACHE_TTL if ttl is None else min(ttl, settings.LOCAL_CACHE_TTL)
+        local_cache.set(key, _to_bytes(value), local_ttl)
+
+# One async client (and connection pool) per event loop. redis.asyncio connections
+# are bound to the loop that opened them, so unlike the sync pool shared with
+# Flask-Session they cannot be shared across loops. Like that pool they block when all
+# connections are in use, as conversions fan out to many more commands than connections
+_clients: dict[asyncio.AbstractEventLoop, redis.Redis] = {}
+
+def get_redis() -> redis.Redis:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+
+    if client is None:
+        pool = redis.BlockingConnectionPool.from_url(REDIS_URL, max_connections=settings.REDIS_POOL_LIMIT,
+                                                     timeout=settings.REDIS_POOL_TIMEOUT)
+        client = redis.Redis.from_pool(pool)
+        _clients[loop] = client
+
+    return client
+
+# Synchronous client on the same process-wide pool as SESSION_REDIS
+def get_sync_redis() -> Redis:
+    return Redis(connection_pool=redis_pool)
+
+# Close the running loop's client. Must be awaited before the loop shuts down
+async def close_redis():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
 
 async def fetch_cache(key):
-    async with redis.from_url(REDIS_URL) as r:
-        return await r.get(key)
+    return (await fetch_cache_many([key]))[0]
 
 async def set_cache(key, value, ttl=3600):
-    async with redis.from_url(REDIS_URL) as r:
-        return await r.setex(key, ttl, value)
+    _set_local(key, value, ttl)
+    return await get_redis().setex(key, ttl, value)
+
+# Get many keys, from the local tier where possible and from Redis in one round trip otherwise
+# Returns values in the same order as keys (None for misses)
+async def fetch_cache_many(keys: list[str]):
+    if not keys:
+        return []
+
+    values = [None] * len(keys)
+    redis_positions = []
+    for position, key in enumerate(keys):
+        local_cache = _local_cache(key)
+        if local_cache is not None:
+            values[position] = local_cache.get(key)
+            _count("local", key, "miss" if values[position] is None else "hit")
+        if values[position] is None:
+            redis_positions.append(position)
+
+    if redis_positions:
+        redis_values = await get_redis().mget([keys[position] for position in redis_positions])
+        for position, value in zip(redis_positions, redis_values):
+            key = keys[position]
+            _count("redis", key, "miss" if value is None else "hit")
+            if value is not None:
+                values[position] = value
+                _set_local(key, value)
+
+    return values
+
+# Set many keys with the same ttl in one pipelined round trip
+async def set_cache_many(mapping: dict, ttl=3600):
+    if not mapping:
+        return []
+
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for key, value in mapping.items():
+            _set_local(key, value, ttl)
+            pipe.setex(key, ttl, value)
+        return await pipe.execute()
@@ -0,0 +1,72 @@
+from app.utils.concurrency import parse_retry_after
+from typing import Callable
+import aiohttp
+import asyncio
+import functools
+import logging
+import random
+import time
+
+RETRYABLE_STATUSES = frozenset({409, 429, 500, 502, 503, 504})
+# For non-idempotent calls (POSTs): a 500, 502 or 504 may hide a request that succeeded,
+# so retrying it could insert twice. These statuses mean the request was not applied
+NON_IDEMPOTENT_RETRYABLE_STATUSES = frozenset({409, 429, 503})
+
+# Async retry with exponential backoff and full jitter
+# Retries upstream responses with a retryable status and connections that could not
+# be established (safe even for non-idempotent calls). Waits at least as long as
+# a Retry-After header asks and never sleeps past max_elapsed seconds in total.
+# give_up can veto retrying errors that are retryable in general but not in context
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 16,
+                 max_elapsed: float = 60, retryable_statuses=RETRYABLE_STATUSES,
+                 give_up: Callable[[Exception], bool] | None = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.retryable_statuses = retryable_statuses
+        self.give_up = give_up
+
+    def is_retryable(self, e: Exception) -> bool:
+        if self.give_up is not None and self.give_up(e):
+            return False
+        if isinstance(e, aiohttp.ClientResponseError):
+            return e.status in self.retryable_statuses
+        return isinstance(e, aiohttp.ClientConnectorError)
+
+    # Delay before the given retry (1 = first retry)
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, func, *args, **kwargs):
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.max_attempts or not self.is_retryable(e):
+                    raise
+
+                delay = self.backoff(attempt)
+                retry_after = parse_retry_after(getattr(e, "headers", None))
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+
+                if time.monotonic() - start + delay > self.max_elapsed:
+                    raise
+
+                reason = f"{e.status} {e.message}" if isinstance(e, aiohttp.ClientResponseError) else repr(e)
+                logging.warning(f"Retrying {func.__name__} in {delay:.2f}s (attempt {attempt + 1}/{self.max_attempts}): {reason}")
+                await asyncio.sleep(delay)
+
+    # Decorator form of call()
+    def __call__(self, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.call(func, *args, **kwargs)
+
+        return wrapper
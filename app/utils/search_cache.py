@@ -0,0 +1,68 @@
+from app.config import config
+from app.utils.redis_utils import fetch_cache_many, set_cache_many
+from app.utils import singleflight
+import asyncio
+
+# Provider-agnostic cache of track search results
+# Keys are {provider}_search:{query}. Queries that found nothing are cached too (as
+# NO_RESULT, for a shorter ttl) so they are not searched again on every conversion
+
+settings = config["default"]
+
+NO_RESULT = "\0"
+
+def _key(provider: str, query: str) -> str:
+    return f"{provider}_search:{query}"
+
+# Look up queries in one round trip
+# Returns {query: id} for cached queries, with None for queries cached as having no result
+async def get_many(provider: str, queries: list[str]) -> dict[str, str | None]:
+    cached = await fetch_cache_many([_key(provider, query) for query in queries])
+
+    results = {}
+    for query, value in zip(queries, cached):
+        if value is not None:
+            value = value.decode("utf-8")
+            results[query] = None if value == NO_RESULT else value
+    return results
+
+# Save search results (None for no result) in pipelined flushes
+async def set_many(provider: str, results: dict[str, str | None]):
+    found = {_key(provider, query): value for query, value in results.items() if value is not None}
+    not_found = {_key(provider, query): NO_RESULT for query, value in results.items() if value is None}
+
+    await set_cache_many(found, ttl=settings.SEARCH_CACHE_TTL)
+    await set_cache_many(not_found, ttl=settings.SEARCH_CACHE_NEGATIVE_TTL)
+
+# Resolve queries through the cache and yield (position, id or None) as each one resolves
+# Duplicate queries are resolved once. Cache hits come first, then search(query) for the
+# misses in completion order. New results are saved in one flush at the end.
+# search results must be JSON-serializable so they can be shared across workers
+async def resolve_as_completed(provider: str, queries: list[str], search):
+    # Positions of each unique query
+    positions: dict[str, list[int]] = {}
+    for position, query in enumerate(queries):
+        positions.setdefault(query, []).append(position)
+
+    cached = await get_many(provider, list(positions))
+    for query, result in cached.items():
+        for position in positions[query]:
+            yield position, result
+
+    # Identical searches running anywhere at the same time share one upstream call
+    async def _search(query: str):
+        return query, await singleflight.do(_key(provider, query), lambda: search(query), distributed=True)
+
+    tasks = [asyncio.create_task(_search(query)) for query in positions if query not in cached]
+    new_results = {}
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            query, result = await next_result
+            new_results[query] = result
+            for position in positions[query]:
+                yield position, result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        await set_many(provider, new_results)
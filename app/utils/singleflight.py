@@ -0,0 +1,59 @@
+from app.utils.redis_utils import get_redis
+from app.utils import locks
+import asyncio
+import json
+import weakref
+
+# Single-flight coalescing of identical upstream calls
+# Concurrent do() calls with the same key on one event loop share a single call of fn.
+# With distributed=True, callers on other loops and workers also share it: the first
+# to take a Redis lock runs fn and publishes the (JSON-serializable) result, the others
+# poll for it. If the leader fails, its lock is released and a follower takes over.
+# The leader renews its lock for as long as fn runs, including time spent queued behind
+# the rate and concurrency limiters, so only a leader that died loses the key
+
+LOCK_TTL = 60 # seconds a dead leader's lock outlives it (renewed every LOCK_TTL / 3 while alive)
+RESULT_TTL = 10 # seconds, how long followers can still pick up a published result
+POLL_INTERVAL = 0.05 # seconds, doubled up to MAX_POLL_INTERVAL while following
+MAX_POLL_INTERVAL = 0.5
+
+_in_flight: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Task]] = weakref.WeakKeyDictionary()
+
+def _retrieve_exception(task: asyncio.Task):
+    # Avoid "exception was never retrieved" when every caller was cancelled
+    if not task.cancelled():
+        task.exception()
+
+async def do(key: str, fn, distributed: bool = False):
+    loop = asyncio.get_running_loop()
+    calls = _in_flight.setdefault(loop, {})
+
+    task = calls.get(key)
+    if task is None:
+        # Run the shared call as its own task so cancelling one caller does not cancel it for the others
+        task = asyncio.create_task(_run_distributed(key, fn) if distributed else fn())
+        task.add_done_callback(_retrieve_exception)
+        task.add_done_callback(lambda _: calls.pop(key, None))
+        calls[key] = task
+
+    return await asyncio.shield(task)
+
+async def _run_distributed(key: str, fn):
+    redis = get_redis()
+    lock_key = f"singleflight:{key}"
+    result_key = f"singleflight:{key}:result"
+    poll_interval = POLL_INTERVAL
+
+    while True:
+        published = await redis.get(result_key)
+        if published is not None:
+            return json.loads(published)
+
+        async with locks.hold(lock_key, LOCK_TTL) as held:
+            if held:
+                result = await fn()
+                await redis.set(result_key, json.dumps(result), ex=RESULT_TTL)
+                return result
+
+        await asyncio.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, MAX_POLL_INTERVAL)
@@ -0,0 +1,85 @@
+from flask import Response, current_app, request
+from flask.globals import request_ctx
+from app.utils.http_client import close_session
+from app.utils.redis_utils import close_redis
+from app.utils import event_loop
+import asyncio
+
+# Opt-in streaming responses (?stream=ndjson or ?stream=sse, or the matching Accept header)
+# Each item is written as soon as it resolves instead of in one JSON document at the end.
+# NDJSON lines are {"event": ..., "data": ...}; SSE uses the event and data fields
+
+NDJSON = "ndjson"
+SSE = "sse"
+
+MIMETYPES = {
+    NDJSON: "application/x-ndjson",
+    SSE: "text/event-stream"
+}
+
+# Requested stream format, or None for a regular JSON response
+def stream_format() -> str | None:
+    requested = request.args.get("stream", "").lower()
+    if requested in MIMETYPES:
+        return requested
+
+    accepted = request.accept_mimetypes
+    for format, mimetype in MIMETYPES.items():
+        if accepted.best == mimetype:
+            return format
+    return None
+
+def encode(format: str, event: str, data) -> str:
+    if format == SSE:
+        return f"event: {event}\ndata: {current_app.json.dumps(data)}\n\n"
+    return current_app.json.dumps({ "event": event, "data": data }) + "\n"
+
+# Drive an async generator from the (sync) response body
+# Served over ASGI, the generator runs on the worker's long-lived loop. Otherwise the view's
+# event loop is already gone by the time the body is written, so the generator gets its
+# own loop, which releases its pooled connections when done
+def iter_async(agen):
+    if event_loop.get_loop() is not None:
+        try:
+            while True:
+                try:
+                    yield event_loop.run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            event_loop.run(agen.aclose())
+        return
+
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(close_session())
+        loop.run_until_complete(close_redis())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+# Stream (event, data) pairs from an async generator. Headers are sent before the first
+# item, so errors raised mid-stream are reported as an error event by on_error(e) -> data
+# The body is written under a copy of the request context (stream_with_context cannot be
+# used from async views, which run in a different context than the one writing the body)
+def stream_response(format: str, events, on_error):
+    ctx = request_ctx.copy()
+
+    def _generate():
+        with ctx:
+            try:
+                for event, data in iter_async(events):
+                    yield encode(format, event, data)
+            except Exception as e:
+                yield encode(format, "error", on_error(e))
+                return
+            yield encode(format, "done", {})
+
+    headers = { "Cache-Control": "no-cache", "X-Accel-Buffering": "no" }
+    return Response(_generate(), mimetype=MIMETYPES[format], headers=headers)
@@ -0,0 +1,77 @@
+from app.config import config
+from app.utils.redis_utils import fetch_cache_many, get_redis
+from app.utils import search_cache
+from contextlib import aclosing
+
+# Durable cross-provider track id mapping
+# track_map:{provider}:{id}:{name}:{target provider} holds the id to insert into the
+# target (Spotify track uri, YouTube videoId). Spotify tracks with an ISRC are also saved
+# under track_map:isrc:{isrc}:{name}:youtube. Entries expire after TRACK_MAP_TTL
+# Ids and names come from request bodies and the mapping is shared by every user, so
+# keys include the normalized name the target was searched by: a body pairing an id
+# with another track's name only maps that pair, never the id with its real name
+
+settings = config["default"]
+
+def _source_id(provider: str, track_id: str) -> str:
+    # Spotify is inserted by uri but listed by id
+    if provider == "spotify":
+        return track_id.removeprefix("spotify:track:")
+    return track_id
+
+def _target_id(provider: str, track_id: str) -> str:
+    if provider == "spotify":
+        return f"spotify:track:{_source_id(provider, track_id)}"
+    return track_id
+
+def _name(track: dict) -> str:
+    return " ".join(track.get("name", "").casefold().split())
+
+def _key(provider: str, track_id: str, name: str, target: str) -> str:
+    return f"track_map:{provider}:{_source_id(provider, track_id)}:{name}:{target}"
+
+# Candidate keys of a track (request body format: "id", "name" and optional "isrc")
+def _keys(source: str, track: dict, target: str) -> list[str]:
+    keys = []
+    if track.get("id"):
+        keys.append(_key(source, track["id"], _name(track), target))
+    if track.get("isrc"):
+        keys.append(_key("isrc", track["isrc"], _name(track), target))
+    return keys
+
+# Look up mapped target ids in one round trip. Returns {position: target id}
+async def get_many(source: str, tracks: list[dict], target: str) -> dict[int, str]:
+    keys_per_track = [_keys(source, track, target) for track in tracks]
+    values = iter(await fetch_cache_many([key for keys in keys_per_track for key in keys]))
+
+    mapped = {}
+    for position, keys in enumerate(keys_per_track):
+        for value in [next(values) for _ in keys]:
+            if value is not None and position not in mapped:
+                mapped[position] = value.decode("utf-8")
+    return mapped
+
+# Save converted (source track, target id) pairs in one pipelined flush
+async def save_many(source: str, target: str, pairs: list[tuple[dict, str]]):
+    if not pairs:
+        return
+
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for track, target_id in pairs:
+            for key in _keys(source, track, target):
+                pipe.set(key, _target_id(target, target_id), ex=settings.TRACK_MAP_TTL)
+        await pipe.execute()
+
+# Resolve tracks to target ids and yield (position, target id or None) as each one resolves
+# Mapped tracks come first, the rest go through the search cache and search(name).
+# source is the provider the tracks were listed from (None if unknown)
+async def resolve_as_completed(source: str | None, target: str, tracks: list[dict], search):
+    mapped = await get_many(source, tracks, target) if source else {}
+    for position, target_id in mapped.items():
+        yield position, target_id
+
+    unmapped = [position for position in range(len(tracks)) if position not in mapped]
+    queries = [tracks[position]["name"] for position in unmapped]
+    async with aclosing(search_cache.resolve_as_completed(target, queries, search)) as results:
+        async for position, target_id in results:
+            yield unmapped[position], target_id
@@ -0,0 +1,33 @@
+from app.config import config
+from app.utils.redis_utils import fetch_cache_many, set_cache_many
+import json
+
+# Cross-user cache of stable YouTube video metadata (categoryId, title, channelTitle)
+# Keys are youtube_video:{videoId} holding JSON. Videos that videos.list did not return
+# (deleted or private) are cached as null for a shorter ttl, since they may come back
+
+settings = config["default"]
+
+def _key(video_id: str) -> str:
+    return f"youtube_video:{video_id}"
+
+# Keep only the snippet fields that practically never change
+def to_metadata(video: dict) -> dict:
+    return {
+        "categoryId": video["snippet"]["categoryId"],
+        "title": video["snippet"]["title"],
+        "channelTitle": video["snippet"]["channelTitle"]
+    }
+
+# Look up videos in one round trip. Returns {videoId: metadata or None} for cached videos
+async def get_many(video_ids: list[str]) -> dict[str, dict | None]:
+    cached = await fetch_cache_many([_key(video_id) for video_id in video_ids])
+    return {video_id: json.loads(value) for video_id, value in zip(video_ids, cached) if value is not None}
+
+# Save video metadata (None for videos that were not returned) in pipelined flushes
+async def set_many(videos: dict[str, dict | None]):
+    found = {_key(video_id): json.dumps(metadata) for video_id, metadata in videos.items() if metadata is not None}
+    not_found = {_key(video_id): json.dumps(None) for video_id, metadata in videos.items() if metadata is None}
+
+    await set_cache_many(found, ttl=settings.VIDEO_CACHE_TTL)
+    await set_cache_many(not_found, ttl=settings.VIDEO_CACHE_NEGATIVE_TTL)
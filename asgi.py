@@ -0,0 +1,87 @@
+from app import app
+from app.config import config
+from app.utils import event_loop, metrics, get_redis, get_session, close_redis, close_session
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import os
+import uvicorn
+
+# ASGI entry point: uvicorn asgi:application (or python asgi.py)
+# Each worker process runs one long-lived event loop. Requests are handled in a pool of
+# threads, and their async views run on that loop (see app/utils/event_loop.py), so
+# upstream and Redis connections, caches and in-flight calls are reused across requests
+
+settings = config["default"]
+
+# Worker processes, and requests each worker handles at the same time
+ASGI_WORKERS = int(os.getenv("ASGI_WORKERS", 2))
+ASGI_THREADS = settings.ASGI_THREADS
+
+executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi")
+
+class WsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every request in one shared thread, so run them in the pool instead
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._run_wsgi_app, thread_sensitive=False, executor=executor)(body)
+
+    # Same steps as asgiref's run_wsgi_app (asgiref==3.7.2): start_response is called in this
+    # thread, and the response is sent once the app yields its first chunk
+    def _run_wsgi_app(self, body):
+        environ = self.build_environ(self.scope, body)
+        bytes_sent = 0
+        for output in self.wsgi_application(environ, self.start_response):
+            if not self.response_started:
+                self.response_started = True
+                self.sync_send(self.response_start)
+            # Never send more than the Content-Length the app declared
+            if self.response_content_length is not None:
+                output = output[:self.response_content_length - bytes_sent]
+            self.sync_send({ "type": "http.response.body", "body": output, "more_body": True })
+            bytes_sent += len(output)
+            if bytes_sent == self.response_content_length:
+                break
+
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({ "type": "http.response.body" })
+
+# Warm the pools on the worker's loop before serving, close them on shutdown
+async def startup():
+    event_loop.set_loop(asyncio.get_running_loop())
+    get_session()
+    await get_redis().ping()
+    logging.info(f"ASGI worker {os.getpid()} started with {ASGI_THREADS} threads")
+
+async def shutdown():
+    event_loop.set_loop(None)
+    await close_session()
+    await close_redis()
+    executor.shutdown(wait=False)
+    metrics.mark_process_dead()
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await startup()
+                except Exception as e:
+                    logging.error(f"ASGI worker failed to start: {e}")
+                    await send({ "type": "lifespan.startup.failed", "message": str(e) })
+                    return
+                await send({ "type": "lifespan.startup.complete" })
+            elif message["type"] == "lifespan.shutdown":
+                await shutdown()
+                await send({ "type": "lifespan.shutdown.complete" })
+                return
+
+    await WsgiInstance(app)(scope, receive, send)
+
+if __name__ == "__main__":
+    uvicorn.run("asgi:application", host="0.0.0.0", port=int(os.getenv("PORT", default=5000)),
+                workers=ASGI_WORKERS, lifespan="on")
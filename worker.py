@@ -0,0 +1,115 @@
+from app.services import ConversionService, CredentialService, RefreshFailed, SpotifyService, YouTubeService
+from app.utils import checkpoints, jobs, quota, rate_limiter, close_session, close_redis
+import aiohttp
+import asyncio
+import logging
+import os
+import prometheus_client
+import signal
+import uuid
+
+# Number of jobs each worker process runs at the same time
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 4))
+
+# Port the worker serves its own Prometheus metrics on (disabled if unset)
+WORKER_METRICS_PORT = os.getenv("WORKER_METRICS_PORT")
+
+# Seconds between heartbeats, well under jobs.WORKER_HEARTBEAT_TTL
+HEARTBEAT_INTERVAL = 10
+
+async def run_job(worker_id: str, job_id: str, job: dict):
+    playlists = job["payload"]["playlists"]
+    progress = jobs.JobProgress(job_id, job["progress"])
+
+    # Provider clients hold the credentials captured when the job was queued, so jobs run
+    # without a Flask request context. The context variable scopes caches and limits to the user
+    rate_limiter.current_user.set(job["user"])
+    credentials = job["payload"]["credentials"]
+
+    await jobs.update_job(job_id, status="running")
+    try:
+        sync = job.get("mode") == "sync"
+        request_key = job["payload"].get("request_key")
+        # Tokens may have expired while the job was queued
+        if job["kind"] == "spotify":
+            spotify = SpotifyService(await CredentialService.refresh_spotify(credentials["spotify_credentials"]))
+            if sync:
+                result = await ConversionService.sync_spotify_playlists(spotify, playlists, progress.update, request_key)
+            else:
+                result = await ConversionService.create_spotify_playlists(spotify, playlists, progress.update, request_key)
+        else:
+            youtube = YouTubeService(await CredentialService.refresh_youtube(credentials["youtube_credentials"]))
+            if sync:
+                estimated_cost = await youtube.estimate_sync_cost(playlists, "spotify")
+                async with quota.reservation(estimated_cost):
+                    result = await ConversionService.sync_youtube_playlists(youtube, playlists, progress.update, request_key)
+            else:
+                estimated_cost = await YouTubeService.estimate_create_cost(playlists, "spotify", request_key)
+                async with quota.reservation(estimated_cost):
+                    result = await ConversionService.create_youtube_playlists(youtube, playlists, progress.update, request_key)
+    except (quota.QuotaExceeded, checkpoints.RequestInProgress, checkpoints.RequestMismatch) as e:
+        await jobs.finish_job(worker_id, job_id, "failed", error=str(e))
+    except RefreshFailed as e:
+        await jobs.finish_job(worker_id, job_id, "failed", error="Not authorized")
+    except aiohttp.ClientResponseError as e:
+        logging.error(f"Job {job_id} failed: {e.status} {e.message}")
+        await jobs.finish_job(worker_id, job_id, "failed", error=f"{e.status} {e.message}")
+    except Exception as e:
+        logging.error(f"Unexpected error in job {job_id}: {e}")
+        await jobs.finish_job(worker_id, job_id, "failed", error="Internal server error. Please contact the developer")
+    else:
+        await jobs.finish_job(worker_id, job_id, "completed", result=result)
+
+async def consume(worker_id: str, stopping: asyncio.Event):
+    while not stopping.is_set():
+        dequeued = await jobs.dequeue_job(worker_id, timeout=1)
+        if dequeued is None:
+            continue
+
+        job_id, job = dequeued
+        logging.info(f"Running job {job_id} ({job['kind']})")
+        # Each job runs in its own task so its context (user) stays isolated
+        await asyncio.create_task(run_job(worker_id, job_id, job))
+
+# Keep the worker registered and pick up the jobs of workers that crashed
+async def keep_alive(worker_id: str, stopping: asyncio.Event):
+    while not stopping.is_set():
+        try:
+            await jobs.heartbeat(worker_id)
+            requeued = await jobs.requeue_stale_jobs()
+            if requeued:
+                logging.info(f"Requeued {requeued} jobs of stopped workers")
+        except Exception as e:
+            logging.error(f"Error in worker.keep_alive: {e}")
+
+        try:
+            await asyncio.wait_for(stopping.wait(), HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def main():
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        # Finish running jobs, stop taking new ones
+        loop.add_signal_handler(signum, stopping.set)
+
+    if WORKER_METRICS_PORT:
+        prometheus_client.start_http_server(int(WORKER_METRICS_PORT))
+
+    worker_id = uuid.uuid4().hex
+    await jobs.heartbeat(worker_id)
+    keep_alive_task = asyncio.create_task(keep_alive(worker_id, stopping))
+
+    logging.info(f"Conversion worker {worker_id} started with concurrency {WORKER_CONCURRENCY}")
+    try:
+        await asyncio.gather(*[consume(worker_id, stopping) for _ in range(WORKER_CONCURRENCY)])
+    finally:
+        stopping.set()
+        await keep_alive_task
+        await jobs.unregister_worker(worker_id)
+        await close_session()
+        await close_redis()
+
+if __name__ == "__main__":
+    asyncio.run(main())